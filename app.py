@@ -1,99 +1,1066 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, send_file, abort, Response
-from datetime import datetime, timedelta
+from flask import Flask, render_template, request, redirect, url_for, jsonify, send_file, abort, Response, g
+from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
-from email.utils import formataddr
+from markupsafe import Markup, escape
 
-import json, os, re, html, urllib.parse
-import smtplib, ssl, csv
-from email.message import EmailMessage
+import json, os, re, urllib.parse, threading, time, uuid, base64, io, zlib
+import hashlib, hmac, functools, bisect, queue, contextlib, math, mimetypes, heapq
+import csv, sqlite3
+import click, jinja2
+# smtplib, ssl i email.* se uvoze tek kad zatrebaju (mail radnik / gradnja
+# poruke) – manje posla pri cold start-u na Render free planu.
+
+try:
+    import fcntl
+except ImportError:  # Windows (lokalni razvoj) – bez međuprocesnog zaključavanja
+    fcntl = None
+
+try:
+    import brotli  # opciono: pip install brotli -> i .br varijante statičkih fajlova
+except ImportError:
+    brotli = None
+
+TZ = ZoneInfo("Europe/Podgorica")
+UTC = timezone.utc
 
 # APP MORA BITI DEFINISAN PRIJE SVIH @app.route
 app = Flask(__name__, template_folder="templates")
 
+# ---- metrike (Prometheus tekst format, /metrics) ----
+# Histogrami su obični nizovi brojača po bucket-u (bisect + += pod lock-om),
+# pa je trošak po zahtjevu par mikrosekundi. Vrijednosti su po procesu.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    def __init__(self, ime, opis, labela, buckets=LATENCY_BUCKETS):
+        self.ime = ime
+        self.opis = opis
+        self.labela = labela
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.serije = {}  # vrijednost labele -> [brojači po bucket-u..., +Inf, suma]
+
+    def observe(self, vrijednost_labele, v):
+        i = bisect.bisect_left(self.buckets, v)
+        with self.lock:
+            s = self.serije.get(vrijednost_labele)
+            if s is None:
+                s = self.serije[vrijednost_labele] = [0] * (len(self.buckets) + 1) + [0.0]
+            s[i] += 1
+            s[-1] += v
+
+    def render(self):
+        out = [f"# HELP {self.ime} {self.opis}", f"# TYPE {self.ime} histogram"]
+        with self.lock:
+            serije = {k: list(v) for k, v in self.serije.items()}
+        for lv, s in sorted(serije.items()):
+            lab = f'{self.labela}="{_prom_escape(lv)}"'
+            kum = 0
+            for b, n in zip(self.buckets, s):
+                kum += n
+                out.append(f'{self.ime}_bucket{{{lab},le="{b}"}} {kum}')
+            kum += s[len(self.buckets)]
+            out.append(f'{self.ime}_bucket{{{lab},le="+Inf"}} {kum}')
+            out.append(f"{self.ime}_sum{{{lab}}} {s[-1]:.6f}")
+            out.append(f"{self.ime}_count{{{lab}}} {kum}")
+        return out
+
+def _prom_escape(s):
+    return str(s).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+ZAHTJEVI_HIST = Histogram("dentalab_request_duration_seconds", "Trajanje obrade zahtjeva po ruti.", "route")
+KORACI_HIST = Histogram("dentalab_step_duration_seconds", "Trajanje pojedinih koraka (SMTP, CSV, DB, JSON).", "step")
+ZAHTJEVI_BROJ = {}  # (metoda, ruta, status) -> broj
+_zahtjevi_lock = threading.Lock()
+
+@contextlib.contextmanager
+def mjeri(korak):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        KORACI_HIST.observe(korak, time.perf_counter() - t0)
+
+@app.before_request
+def _metrika_start():
+    g.metrika_t0 = time.perf_counter()
+
+@app.after_request
+def _metrika_kraj(resp):
+    t0 = g.pop("metrika_t0", None)
+    if t0 is not None:
+        ruta = request.url_rule.rule if request.url_rule is not None else "<nepoznata>"
+        ZAHTJEVI_HIST.observe(ruta, time.perf_counter() - t0)
+        kljuc = (request.method, ruta, resp.status_code)
+        with _zahtjevi_lock:
+            ZAHTJEVI_BROJ[kljuc] = ZAHTJEVI_BROJ.get(kljuc, 0) + 1
+    return resp
+
+
 # ---- ICS helperi ----
 def _ics_ts(dt_aware):
     # očekuje timezone-aware datetime; u .ics pišemo u UTC
     return dt_aware.strftime("%Y%m%dT%H%M%SZ")
 
-def build_ics(summary, dt_local, duration_min=60, description="", location=""):
-    # pretvaramo start/end u UTC radi kompatibilnosti
-    dt_start_utc = dt_local.astimezone(ZoneInfo("UTC"))
-    dt_end_utc = (dt_local + timedelta(minutes=duration_min)).astimezone(ZoneInfo("UTC"))
-
-    start_s = _ics_ts(dt_start_utc)
-    end_s   = _ics_ts(dt_end_utc)
-    uid = f"{start_s}-{abs(hash((summary, start_s)))}@dentalab"
-
+def _ics_tekst(s):
     # escape novih redova
-    desc = (description or "").replace("\r\n", "\n").replace("\n", "\\n")
-    loc  = (location or "").replace("\r\n", "\n").replace("\n", "\\n")
-    summ = (summary or "Termin").replace("\n", " ")
+    return (s or "").replace("\r\n", "\n").replace("\n", "\\n")
+
+def _ics_vevent(uid, summary, dtstart, dtend, description="", location="", dtstamp=None, all_day=False):
+    """Jedan VEVENT blok; dtstart/dtend su aware datetime (ili date za all_day)."""
+    if all_day:
+        start_l = f"DTSTART;VALUE=DATE:{dtstart.strftime('%Y%m%d')}"
+        end_l = f"DTEND;VALUE=DATE:{dtend.strftime('%Y%m%d')}"
+        stamp = dtstamp or dtstart.strftime("%Y%m%dT000000Z")
+    else:
+        start_l = f"DTSTART:{_ics_ts(dtstart.astimezone(UTC))}"
+        end_l = f"DTEND:{_ics_ts(dtend.astimezone(UTC))}"
+        stamp = dtstamp or _ics_ts(dtstart.astimezone(UTC))
+    return (
+        "BEGIN:VEVENT\r\n"
+        f"UID:{uid}\r\n"
+        f"DTSTAMP:{stamp}\r\n"
+        f"{start_l}\r\n"
+        f"{end_l}\r\n"
+        f"SUMMARY:{(summary or 'Termin').replace(chr(10), ' ')}\r\n"
+        f"DESCRIPTION:{_ics_tekst(description)}\r\n"
+        f"LOCATION:{_ics_tekst(location)}\r\n"
+        "END:VEVENT\r\n"
+    )
 
+def _ics_kalendar(vevents, prodid="-//Dentalab//Appointment//EN", zaglavlje=""):
     return (
         "BEGIN:VCALENDAR\r\n"
         "VERSION:2.0\r\n"
-        "PRODID:-//Dentalab//Appointment//EN\r\n"
+        f"PRODID:{prodid}\r\n"
         "CALSCALE:GREGORIAN\r\n"
         "METHOD:PUBLISH\r\n"
-        "BEGIN:VEVENT\r\n"
-        f"UID:{uid}\r\n"
-        f"DTSTAMP:{start_s}\r\n"
-        f"DTSTART:{start_s}\r\n"
-        f"DTEND:{end_s}\r\n"
-        f"SUMMARY:{summ}\r\n"
-        f"DESCRIPTION:{desc}\r\n"
-        f"LOCATION:{loc}\r\n"
-        "END:VEVENT\r\n"
-        "END:VCALENDAR\r\n"
+        + zaglavlje
+        + "".join(vevents)
+        + "END:VCALENDAR\r\n"
+    )
+
+def build_ics(summary, dt_local, duration_min=60, description="", location=""):
+    # pretvaramo start/end u UTC radi kompatibilnosti
+    dt_start_utc = dt_local.astimezone(UTC)
+    dt_end_utc = (dt_local + timedelta(minutes=duration_min)).astimezone(UTC)
+
+    start_s = _ics_ts(dt_start_utc)
+    end_s   = _ics_ts(dt_end_utc)
+    # UID iz sadržaja (hash() je nasumičan po procesu -> drugačiji UID po workeru)
+    uid_izvor = "\x1f".join([summary or "", start_s, end_s, description or "", location or ""])
+    uid = f"{start_s}-{hashlib.sha1(uid_izvor.encode('utf-8')).hexdigest()[:20]}@dentalab"
+
+    return _ics_kalendar([
+        _ics_vevent(uid, summary, dt_start_utc, dt_end_utc, description, location)
+    ])
+
+ICS_KES_MAX = int(os.environ.get("ICS_KES_MAX", "512"))
+ICS_MAX_AGE = int(os.environ.get("ICS_MAX_AGE", "86400"))
+
+@functools.lru_cache(maxsize=ICS_KES_MAX)
+def _ics_za_upit(title, start, duration, details, location):
+    """Normalizovan upit -> (ics tekst, ETag). Isti upit = isti bajtovi."""
+    dt_local = datetime.strptime(start, "%Y-%m-%d %H:%M").replace(
+        tzinfo=TZ
+    )
+    ics_text = build_ics(
+        summary=title,
+        dt_local=dt_local,
+        duration_min=duration,
+        description=details,
+        location=location,
     )
+    return ics_text, hashlib.sha1(ics_text.encode("utf-8")).hexdigest()
 
 @app.get("/event.ics")
 def event_ics():
     title = (request.args.get("title") or "Termin").strip()
     start = (request.args.get("start") or "").strip()  # "YYYY-MM-DD HH:MM"
-    duration = int((request.args.get("dur") or "60").strip())
+    duration = to_int_or_none((request.args.get("dur") or "60").strip())
     details = (request.args.get("details") or "").strip()
     location = (request.args.get("loc") or "").strip()
 
+    if duration is None or not (0 < duration <= 24 * 60):
+        return "Bad dur", 400
     try:
-        dt_local = datetime.strptime(start, "%Y-%m-%d %H:%M").replace(
-            tzinfo=ZoneInfo("Europe/Podgorica")
-        )
-    except Exception:
+        ics_text, etag = _ics_za_upit(title, start, duration, details, location)
+    except ValueError:
         return "Bad start", 400
 
-    ics_text = build_ics(
-        summary=title,
-        dt_local=dt_local,
-        duration_min=duration,
-        description=details,
-        location=location,
-    )
-    return Response(
+    resp = Response(
         ics_text,
         mimetype="text/calendar",
         headers={"Content-Disposition": 'attachment; filename="termin.ics"'}
     )
+    # sadržaj zavisi samo od upita -> jak ETag + dug keš; If-None-Match -> 304
+    resp.set_etag(etag)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = ICS_MAX_AGE
+    return resp.make_conditional(request)
 
 
 # --- podesiva putanja za CSV (na Renderu koristi /data/poruke.csv) ---
 CSV_PATH = os.environ.get("CSV_PATH") or os.path.join(app.instance_path, "poruke.csv")
 DEFAULT_COUNTRY_CODE = os.environ.get("DEFAULT_COUNTRY_CODE", "+382")
+CSV_HEADER = ["datetime", "ime", "kontakt", "ip", "poruka"]
+CSV_HEADER_STARI = ["datetime", "ime", "ip", "poruka"]  # prije kolone "kontakt"
+
+# --- kontakt helperi ---
+def is_email(s):
+    if not s:
+        return False
+    return "@" in s and "." in s.split("@")[-1]
+
+_NE_TELEFON_RE = re.compile(r"[^\d+]")
+_PLUSEVI_RE = re.compile(r"\++")
+_NE_CIFRA_RE = re.compile(r"\D")
+
+def normalize_phone(raw):
+    """
+    Normalizuje telefon:
+    - dozvoljava cifre i '+'
+    - 00xx pretvara u +xx
+    - ako počinje nulom bez '+', a DEFAULT_COUNTRY_CODE je postavljen -> doda se pozivni
+    - vraća None ako nema najmanje 7 cifara
+    """
+    if not raw:
+        return None
+
+    # zadrži samo + i cifre
+    s = _NE_TELEFON_RE.sub("", raw)
+
+    if not s:
+        return None
+
+    # 00xx -> +xx
+    if s.startswith("00"):
+        s = "+" + s[2:]
+
+    # saniraj višak '+'
+    if s.count("+") > 1:
+        s = _PLUSEVI_RE.sub("+", s)
+    if "+" in s[1:]:
+        s = s[0] + s[1:].replace("+", "")
+
+    # ako počinje '0' i nema '+', dodaj pozivni (ako je definisan)
+    if s.startswith("0") and not s.startswith("+") and DEFAULT_COUNTRY_CODE:
+        s = DEFAULT_COUNTRY_CODE + s.lstrip("0")
+
+    # minimalno 7 cifara
+    digits = _NE_CIFRA_RE.sub("", s)
+    if len(digits) < 7:
+        return None
+
+    return s
+
+@functools.lru_cache(maxsize=4096)
+def classify_kontakt(k):
+    """
+    Vraća (tip, vrijednost):
+    - ("email", email) / ("phone", normalizovan_broj) / ("text", original)
+    """
+    k = (k or "").strip()
+    if not k:
+        return ("text", "")
+    if is_email(k):
+        return ("email", k)
+    phone = normalize_phone(k)
+    if phone:
+        return ("phone", phone)
+    return ("text", k)
 
-# --- CSV init: napravi fajl sa headerom ako ne postoji ---
+def kanon_kontakta(k):
+    """Kanonski ključ pošiljaoca: 'email:ana@x.me' / 'tel:+38267123456' / '' (slobodan tekst)."""
+    tip, val = classify_kontakt(k)
+    if tip == "email":
+        return "email:" + val.lower()
+    if tip == "phone":
+        return "tel:" + val
+    return ""
+
+# Dnevnik je podijeljen po mjesecima: /data/poruke/2025-03.csv (mjesec iz
+# kolone datetime, lokalno vrijeme). CSV_PATH je sad samo stari nepodijeljeni
+# fajl – kompakcija ga razbije po mjesecima pa obriše.
+DNEVNIK_DIR = os.environ.get("DNEVNIK_DIR") or os.path.splitext(CSV_PATH)[0]
+_MJESEC_RE = re.compile(r"\d{4}-\d{2}$")
+
+def mjesec_dnevnika(ts):
+    """'2025-03-14T09:30:00+01:00' -> '2025-03'."""
+    m = (ts or "")[:7]
+    return m if _MJESEC_RE.match(m) else datetime.now(TZ).strftime("%Y-%m")
+
+def segment_dnevnika(mjesec, gz=False):
+    return os.path.join(DNEVNIK_DIR, mjesec + (".csv.gz" if gz else ".csv"))
+
+# --- CSV init: napravi direktorijum dnevnika ---
 def ensure_csv():
     try:
-        dirpath = os.path.dirname(CSV_PATH)
-        if dirpath:
-            os.makedirs(dirpath, exist_ok=True)
-        if not os.path.exists(CSV_PATH):
-            with open(CSV_PATH, "w", newline="", encoding="utf-8") as f:
-                csv.writer(f).writerow(["datetime", "ime", "kontakt", "ip", "poruka"])
+        os.makedirs(DNEVNIK_DIR, exist_ok=True)
     except Exception as e:
         print(f"CSV init error: {e}", flush=True)
 
 ensure_csv()
 
+# ---- CSV dnevnik: grupni upis (group commit) ----
+# Redovi iz istovremenih zahtjeva skupljaju se CSV_BATCH_MS milisekundi pa
+# idu u segment jednim write-om pod flock-om (više workera dijeli segment).
+# CSV_FSYNC=batch   -> fsync po paketu, zahtjev čeka da je red na disku
+# CSV_FSYNC=interval -> fsync najviše svakih CSV_FSYNC_MS, zahtjev čeka samo write
+CSV_FSYNC = os.environ.get("CSV_FSYNC", "batch")
+CSV_FSYNC_MS = float(os.environ.get("CSV_FSYNC_MS", "50"))
+CSV_BATCH_MS = float(os.environ.get("CSV_BATCH_MS", "5"))
+
+class _CsvPaket:
+    __slots__ = ("redovi", "gotovo", "greska")
+
+    def __init__(self):
+        self.redovi = []
+        self.gotovo = threading.Event()
+        self.greska = None
+
+class GrupniCsvPisac:
+    def __init__(self, fsync_mod="batch", fsync_ms=50.0, batch_ms=5.0):
+        self.fsync_mod = fsync_mod
+        self.fsync_s = fsync_ms / 1000.0
+        self.batch_s = batch_ms / 1000.0
+        self.cond = threading.Condition()
+        self.tekuci = _CsvPaket()
+        self.fajlovi = {}  # mjesec -> otvoren segment (tekući i, oko prelaza, prethodni)
+        self.prljavi = set()  # upisani a još ne fsync-ovani (CSV_FSYNC=interval)
+        self.zadnji_fsync = 0.0
+        self.stats = {"redova": 0, "paketa": 0, "fsync": 0}
+
+    def upisi(self, red, timeout=10.0):
+        """Doda red u tekući paket i čeka da ga nit upiše."""
+        pokreni_nit("csv-pisac", self._petlja)
+        with self.cond:
+            paket = self.tekuci
+            paket.redovi.append(red)
+            self.cond.notify()
+        if not paket.gotovo.wait(timeout):
+            raise TimeoutError("CSV upis nije završen na vrijeme")
+        if paket.greska is not None:
+            raise paket.greska
+
+    def _fajl(self, mjesec):
+        # ponovo otvori ako je fajl obrisan/zamijenjen (kompakcija, ručno brisanje)
+        path = segment_dnevnika(mjesec)
+        f = self.fajlovi.get(mjesec)
+        try:
+            ino = os.stat(path).st_ino
+        except FileNotFoundError:
+            ino = None
+        if f is None or ino != os.fstat(f.fileno()).st_ino:
+            if f is not None:
+                self._zatvori(mjesec)
+            os.makedirs(DNEVNIK_DIR, exist_ok=True)
+            f = self.fajlovi[mjesec] = open(path, "ab")
+            for stari in sorted(self.fajlovi)[:-2]:
+                self._zatvori(stari)
+        return f
+
+    def _zatvori(self, mjesec):
+        f = self.fajlovi.pop(mjesec)
+        if f in self.prljavi:
+            os.fsync(f.fileno())
+            self.prljavi.discard(f)
+        f.close()
+
+    def _fsync(self):
+        for f in self.prljavi:
+            os.fsync(f.fileno())
+        self.prljavi.clear()
+        self.zadnji_fsync = time.monotonic()
+        self.stats["fsync"] += 1
+
+    def _zapisi(self, redovi):
+        with mjeri("csv_write"):
+            self._zapisi_paket(redovi)
+
+    def _zapisi_paket(self, redovi):
+        po_mjesecu = {}
+        for red in redovi:
+            po_mjesecu.setdefault(mjesec_dnevnika(red[0]), []).append(red)
+        for mjesec, dio in po_mjesecu.items():
+            buf = io.StringIO()
+            csv.writer(buf).writerows(dio)
+            data = buf.getvalue().encode("utf-8")
+            while True:
+                f = self._fajl(mjesec)
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    st = os.fstat(f.fileno())
+                    if st.st_nlink == 0:
+                        continue  # kompakcija je upravo zatvorila segment -> novi fajl
+                    if st.st_size == 0:
+                        hdr = io.StringIO()
+                        csv.writer(hdr).writerow(CSV_HEADER)
+                        data = hdr.getvalue().encode("utf-8") + data
+                    f.write(data)
+                    f.flush()
+                    self.prljavi.add(f)
+                    break
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        if self.fsync_mod != "interval" or time.monotonic() - self.zadnji_fsync >= self.fsync_s:
+            self._fsync()
+        self.stats["redova"] += len(redovi)
+        self.stats["paketa"] += 1
+
+    def _petlja(self):
+        while True:
+            with self.cond:
+                while not self.tekuci.redovi:
+                    if self.prljavi:
+                        ostalo = self.fsync_s - (time.monotonic() - self.zadnji_fsync)
+                        if ostalo <= 0:
+                            try:
+                                self._fsync()
+                            except OSError as e:
+                                print(f"CSV fsync error: {e}", flush=True)
+                            continue
+                        self.cond.wait(ostalo)
+                    else:
+                        self.cond.wait()
+            # prozor za skupljanje redova iz drugih niti
+            if self.batch_s > 0:
+                time.sleep(self.batch_s)
+            with self.cond:
+                paket, self.tekuci = self.tekuci, _CsvPaket()
+            try:
+                self._zapisi(paket.redovi)
+            except Exception as e:
+                paket.greska = e
+            paket.gotovo.set()
+
+csv_pisac = GrupniCsvPisac(CSV_FSYNC, CSV_FSYNC_MS, CSV_BATCH_MS)
+
+# ---- SQLite baza poruka (WAL) ----
+# Baza je izvor istine za poruke (indeksi po vremenu i kontaktu); CSV ostaje
+# kao običan append-only dnevnik koji se može skinuti sa diska.
+DB_PATH = os.environ.get("DB_PATH") or os.path.splitext(CSV_PATH)[0] + ".sqlite3"
+_db_local = threading.local()
+
+SHEMA = """
+CREATE TABLE IF NOT EXISTS poruke (
+    id      INTEGER PRIMARY KEY,
+    ts      TEXT    NOT NULL,            -- ISO 8601 sa offsetom, kao u CSV-u
+    ts_utc  INTEGER NOT NULL,            -- epoch sekunde (opseg + sortiranje)
+    ime     TEXT    NOT NULL DEFAULT '',
+    kontakt TEXT    NOT NULL DEFAULT '',
+    ip      TEXT    NOT NULL DEFAULT '',
+    poruka  TEXT    NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS poruke_ts ON poruke(ts_utc);
+CREATE INDEX IF NOT EXISTS poruke_kontakt ON poruke(kontakt, ts_utc);
+CREATE TABLE IF NOT EXISTS meta (
+    kljuc      TEXT PRIMARY KEY,
+    vrijednost TEXT
+);
+CREATE TABLE IF NOT EXISTS termini (
+    id           INTEGER PRIMARY KEY,
+    start_utc    INTEGER NOT NULL,       -- epoch sekunde
+    trajanje_min INTEGER NOT NULL,
+    ime          TEXT    NOT NULL DEFAULT '',
+    email        TEXT    NOT NULL DEFAULT '',
+    telefon      TEXT    NOT NULL DEFAULT '',
+    napomena     TEXT    NOT NULL DEFAULT '',
+    kreirano     INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS termini_start ON termini(start_utc);
+CREATE TABLE IF NOT EXISTS podsjetnici (
+    id        INTEGER PRIMARY KEY,
+    termin_id INTEGER NOT NULL REFERENCES termini(id),
+    vrsta     TEXT    NOT NULL,          -- "24h" / "2h"
+    rok_utc   INTEGER NOT NULL,          -- epoch sekunde kad treba poslati
+    poslato   INTEGER,                   -- NULL = čeka; epoch obrade
+    status    TEXT    NOT NULL DEFAULT '', -- poslato / preskoceno
+    UNIQUE (termin_id, vrsta)
+);
+CREATE INDEX IF NOT EXISTS podsjetnici_rok ON podsjetnici(rok_utc) WHERE poslato IS NULL;
+CREATE TABLE IF NOT EXISTS kontakti (
+    kanon   TEXT    NOT NULL,           -- "email:ana@x.me" / "tel:+38267123456"
+    vrsta   TEXT    NOT NULL,           -- "poruka" / "termin"
+    ts_utc  INTEGER NOT NULL,           -- vrijeme poruke / početak termina
+    ref_id  INTEGER NOT NULL,           -- poruke.id / termini.id
+    PRIMARY KEY (kanon, vrsta, ts_utc, ref_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS limiter (
+    kljuc   TEXT PRIMARY KEY,           -- "ip:1.2.3.4" / "kontakt:x@y.me"
+    tokeni  REAL NOT NULL,
+    ts      REAL NOT NULL               -- epoch sekunde zadnje izmjene
+) WITHOUT ROWID;
+"""
+
+def db():
+    """
+    Konekcija po niti. WAL dozvoljava čitanje paralelno sa upisom, a
+    busy_timeout serijalizuje upise iz više niti/workera bez grešaka.
+    """
+    con = getattr(_db_local, "con", None)
+    if con is None or _db_local.pid != os.getpid():
+        con = sqlite3.connect(DB_PATH, timeout=10, isolation_level=None, check_same_thread=False)
+        con.row_factory = sqlite3.Row
+        # važi samo za novu bazu (prije WAL zaglavlja); retencija koristi incremental_vacuum
+        con.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.execute("PRAGMA busy_timeout=10000")
+        _db_local.con = con
+        _db_local.pid = os.getpid()
+    return con
+
+class transakcija:
+    """`with transakcija() as con:` -> BEGIN IMMEDIATE ... COMMIT/ROLLBACK."""
+
+    def __enter__(self):
+        self.con = db()
+        self.con.execute("BEGIN IMMEDIATE")
+        return self.con
+
+    def __exit__(self, exc_type, exc, tb):
+        self.con.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+def _ts_utc(ts):
+    try:
+        return int(datetime.fromisoformat(ts).timestamp())
+    except (ValueError, TypeError):
+        return 0
+
+def sacuvaj_poruku(ts, ime, kontakt, ip, poruka):
+    ts_utc = _ts_utc(ts)
+    with mjeri("db_write"), transakcija() as con:
+        cur = con.execute(
+            "INSERT INTO poruke (ts, ts_utc, ime, kontakt, ip, poruka) VALUES (?, ?, ?, ?, ?, ?)",
+            (ts, ts_utc, ime or "", kontakt or "", ip or "", poruka or ""),
+        )
+        _dodaj_kontakte(con, "poruka", cur.lastrowid, ts_utc, kontakt)
+    return cur.lastrowid
+
+def _dodaj_kontakte(con, vrsta, ref_id, ts_utc, *kontakti):
+    """Upis u indeks kontakata (kanonski email/telefon -> poruka/termin)."""
+    for kanon in {kanon_kontakta(k) for k in kontakti} - {""}:
+        con.execute(
+            "INSERT OR IGNORE INTO kontakti (kanon, vrsta, ts_utc, ref_id) VALUES (?, ?, ?, ?)",
+            (kanon, vrsta, ts_utc, ref_id),
+        )
+
+def istorija_kontakta(kanon, prije_utc, prije_id=2**63 - 1):
+    """
+    {"poruka": N, "termin": M, "zadnje": epoch} za pošiljaoca prije (prije_utc,
+    prije_id); bez prije_id se broji i sve iz iste sekunde (ts_utc je u sekundama).
+    """
+    ist = {"poruka": 0, "termin": 0, "zadnje": None}
+    if not kanon:
+        return ist
+    for vrsta, n, zadnje in db().execute(
+        "SELECT vrsta, COUNT(*), MAX(ts_utc) FROM kontakti WHERE kanon = ? AND (ts_utc, ref_id) < (?, ?) "
+        "GROUP BY vrsta",
+        (kanon, prije_utc, prije_id),
+    ):
+        ist[vrsta] = n
+        ist["zadnje"] = max(zadnje, ist["zadnje"] or 0)
+    return ist
+
+def opis_istorije(ist):
+    """'Pacijent se vraća — prethodnih poruka: 3, termina: 1 (zadnji kontakt 12.09.2025)' ili ''."""
+    if not ist["poruka"] and not ist["termin"]:
+        return ""
+    zadnje = datetime.fromtimestamp(ist["zadnje"], TZ).strftime("%d.%m.%Y")
+    return (f"Pacijent se vraća — prethodnih poruka: {ist['poruka']}, termina: {ist['termin']} "
+            f"(zadnji kontakt {zadnje})")
+
+def indeksiraj_kontakte(force=False):
+    """
+    Jedan prolaz kroz sve poruke i termine (kursor u paketima) -> tabela
+    kontakti. Oznaka u meta sprječava ponavljanje; vraća broj upisanih ključeva.
+    """
+    def paketi(cur):
+        while True:
+            paket = cur.fetchmany(1000)
+            if not paket:
+                return
+            yield paket
+
+    sql = "INSERT OR IGNORE INTO kontakti (kanon, vrsta, ts_utc, ref_id) VALUES (?, ?, ?, ?)"
+    with transakcija() as con:
+        if not force and con.execute("SELECT 1 FROM meta WHERE kljuc = 'kontakti_indeksirani'").fetchone():
+            return 0
+        con.execute("DELETE FROM kontakti")
+        n = 0
+        for paket in paketi(con.execute("SELECT id, ts_utc, kontakt FROM poruke WHERE kontakt != ''")):
+            redovi = [(kanon_kontakta(k), "poruka", ts, i) for i, ts, k in paket]
+            redovi = [r for r in redovi if r[0]]
+            con.executemany(sql, redovi)
+            n += len(redovi)
+        for paket in paketi(con.execute("SELECT id, start_utc, email, telefon FROM termini")):
+            redovi = [(kanon, "termin", ts, i) for i, ts, email, tel in paket
+                      for kanon in {kanon_kontakta(email), kanon_kontakta(tel)} if kanon]
+            con.executemany(sql, redovi)
+            n += len(redovi)
+        con.execute(
+            "INSERT OR REPLACE INTO meta (kljuc, vrijednost) VALUES ('kontakti_indeksirani', ?)",
+            (json.dumps({"kljuceva": n, "vrijeme": time.time()}),),
+        )
+    return n
+
+def termini_verzija(con=None):
+    """Brojač koji se povećava sa svakom izmjenom tabele termini."""
+    row = (con or db()).execute("SELECT vrijednost FROM meta WHERE kljuc = 'termini_verzija'").fetchone()
+    return int(row[0]) if row else 0
+
+def _povecaj_termini_verziju(con):
+    con.execute(
+        "INSERT INTO meta (kljuc, vrijednost) VALUES ('termini_verzija', '1') "
+        "ON CONFLICT(kljuc) DO UPDATE SET vrijednost = CAST(vrijednost AS INTEGER) + 1"
+    )
+
+class TerminNijeSlobodan(Exception):
+    pass
+
+def sacuvaj_termin(dt_local, trajanje_min, ime="", email="", telefon="", napomena="", provjeri_preklapanje=False):
+    """
+    Upis termina. Sa provjeri_preklapanje=True provjera i upis su u istoj
+    BEGIN IMMEDIATE transakciji -> dva workera ne mogu zauzeti isti termin.
+    """
+    start_utc = int(dt_local.timestamp())
+    with transakcija() as con:
+        if provjeri_preklapanje and con.execute(
+            "SELECT 1 FROM termini WHERE start_utc < ? AND start_utc + trajanje_min * 60 > ? "
+            "AND start_utc > ? LIMIT 1",
+            (start_utc + trajanje_min * 60, start_utc, start_utc - 24 * 3600),
+        ).fetchone():
+            raise TerminNijeSlobodan("Termin je već zauzet.")
+        cur = con.execute(
+            "INSERT INTO termini (start_utc, trajanje_min, ime, email, telefon, napomena, kreirano) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (start_utc, trajanje_min, ime or "", email or "", telefon or "", napomena or "", int(time.time())),
+        )
+        _dodaj_podsjetnike(con, cur.lastrowid, start_utc)
+        _dodaj_kontakte(con, "termin", cur.lastrowid, start_utc, email, telefon)
+        _povecaj_termini_verziju(con)
+        return cur.lastrowid
+
+# koliko sati prije termina idu podsjetnici (mail radi raspored_podsjetnika)
+PODSJETNICI_SATI = tuple(sorted(
+    {float(x) for x in os.environ.get("PODSJETNICI_SATI", "24,2").split(",") if x.strip()}, reverse=True
+))
+
+def _vrsta_podsjetnika(sati):
+    return f"{sati:g}h"
+
+def _dodaj_podsjetnike(con, termin_id, start_utc):
+    """Redovi u podsjetnici za novi termin (samo oni čiji rok još nije prošao)."""
+    sada = time.time()
+    for sati in PODSJETNICI_SATI:
+        rok = start_utc - int(sati * 3600)
+        if rok > sada:
+            con.execute(
+                "INSERT OR IGNORE INTO podsjetnici (termin_id, vrsta, rok_utc) VALUES (?, ?, ?)",
+                (termin_id, _vrsta_podsjetnika(sati), rok),
+            )
+
+def _csv_redovi(path):
+    """
+    Čita CSV dnevnik bez obzira na verziju header-a: stari fajlovi imaju
+    header bez "kontakt", a noviji redovi (5 kolona) su dopisani ispod njega.
+    """
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        yield from _csv_redovi_iz(f)
+
+def _csv_redovi_iz(linije):
+    for row in csv.reader(linije):
+        if not row or row in (CSV_HEADER, CSV_HEADER_STARI):
+            continue
+        if len(row) == len(CSV_HEADER):
+            yield dict(zip(CSV_HEADER, row))
+        elif len(row) == len(CSV_HEADER_STARI):
+            yield dict(zip(CSV_HEADER_STARI, row), kontakt="")
+
+# ---- arhiva dnevnika: zatvoreni mjeseci u gzip + indeks ----
+# Kompakcija pretvara segment prošlog mjeseca u YYYY-MM.csv.gz kao niz gzip
+# članova, po jedan za svaki dan. index.json pamti za svaki zatvoreni segment
+# opseg vremena i [od, do, offset, dužina] svakog člana, pa čitanje opsega
+# (npr. zadnja sedmica) otvara samo segmente koji se preklapaju i dekompresuje
+# samo potrebne dane. .csv.gz je i dalje običan gzip (zcat ga čita cijelog).
+DNEVNIK_INDEKS = os.path.join(DNEVNIK_DIR, "index.json")
+DNEVNIK_RETENCIJA_MJESECI = int(os.environ.get("DNEVNIK_RETENCIJA_MJESECI", "24"))  # 0 = bez limita
+DNEVNIK_MAX_MB = float(os.environ.get("DNEVNIK_MAX_MB", "200"))  # 0 = bez limita
+DNEVNIK_KOMPAKCIJA_S = float(os.environ.get("DNEVNIK_KOMPAKCIJA_S", str(6 * 3600)))
+
+def ucitaj_indeks_dnevnika():
+    try:
+        with open(DNEVNIK_INDEKS, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"segmenti": {}}
+
+def _pomjeri_mjesec(mjesec, n):
+    g, m = map(int, mjesec.split("-"))
+    k = g * 12 + m - 1 + n
+    return f"{k // 12:04d}-{k % 12 + 1:02d}"
+
+def _granice_mjeseca(mjesec):
+    """'2025-03' -> (epoch početka, epoch početka sljedećeg mjeseca), lokalno."""
+    g, m = map(int, mjesec.split("-"))
+    sljedeci = _pomjeri_mjesec(mjesec, 1)
+    g2, m2 = map(int, sljedeci.split("-"))
+    return (int(datetime(g, m, 1, tzinfo=TZ).timestamp()), int(datetime(g2, m2, 1, tzinfo=TZ).timestamp()))
+
+def _gz_clanovi(data):
+    """Gzip sa više članova -> [(offset, dužina, dekompresovan tekst)]."""
+    out, off = [], 0
+    while off < len(data):
+        d = zlib.decompressobj(31)
+        tekst = d.decompress(data[off:])
+        duz = len(data) - off - len(d.unused_data)
+        out.append((off, duz, tekst.decode("utf-8")))
+        off += duz
+    return out
+
+def _upisi_segment(mjesec, redovi):
+    """Redovi jednog mjeseca -> YYYY-MM.csv.gz (član po danu); vraća zapis za indeks."""
+    redovi = sorted(redovi, key=lambda r: _ts_utc(r["datetime"]))
+    po_danu = {}
+    for r in redovi:
+        po_danu.setdefault(r["datetime"][:10], []).append(r)
+    path = segment_dnevnika(mjesec, gz=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    blokovi, off = [], 0
+    with open(tmp, "wb") as f:
+        for i, dan in enumerate(sorted(po_danu)):
+            dio = po_danu[dan]
+            buf = io.StringIO()
+            w = csv.writer(buf)
+            if i == 0:
+                w.writerow(CSV_HEADER)
+            w.writerows([r[k] for k in CSV_HEADER] for r in dio)
+            z = zlib.compressobj(6, zlib.DEFLATED, 31)
+            clan = z.compress(buf.getvalue().encode("utf-8")) + z.flush()
+            f.write(clan)
+            blokovi.append([_ts_utc(dio[0]["datetime"]), _ts_utc(dio[-1]["datetime"]), off, len(clan)])
+            off += len(clan)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return {
+        "fajl": os.path.basename(path), "od": blokovi[0][0], "do": blokovi[-1][1],
+        "redova": len(redovi), "bajtova": off, "blokovi": blokovi,
+    }
+
+def _redovi_gz(mjesec):
+    try:
+        with open(segment_dnevnika(mjesec, gz=True), "rb") as f:
+            clanovi = _gz_clanovi(f.read())
+    except FileNotFoundError:
+        return []
+    return [r for _, _, tekst in clanovi for r in _csv_redovi_iz(io.StringIO(tekst, newline=""))]
+
+def _kljuc_reda(r):
+    return tuple(r[k] for k in CSV_HEADER)
+
+def _bez_duplikata(redovi, vec_ima=()):
+    """
+    Izbaci redove koji su već viđeni (cijeli red, datetime je u mikrosekundama).
+    Zbog toga su spajanje .csv u .csv.gz i razbijanje starog CSV-a idempotentni:
+    pad između upisa i brisanja izvora ne duplira redove pri ponovnom pokretanju.
+    """
+    vidjeni = set(vec_ima)
+    out = []
+    for r in redovi:
+        k = _kljuc_reda(r)
+        if k not in vidjeni:
+            vidjeni.add(k)
+            out.append(r)
+    return out
+
+def _kompaktuj_mjesec(mjesec, indeks):
+    """YYYY-MM.csv (+ postojeći .csv.gz, npr. zakašnjeli redovi) -> novi .csv.gz."""
+    path = segment_dnevnika(mjesec)
+    with open(path, "rb") as f:
+        # isti flock kao GrupniCsvPisac: poslije unlink-a pisac otvara novi fajl
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        redovi = _bez_duplikata(
+            _redovi_gz(mjesec) + list(_csv_redovi_iz(io.StringIO(f.read().decode("utf-8"), newline="")))
+        )
+        if redovi:
+            indeks["segmenti"][mjesec] = _upisi_segment(mjesec, redovi)
+        os.unlink(path)
+    _fsync_dir(DNEVNIK_DIR)
+
+def _razbij_stari_csv():
+    """
+    Stari CSV_PATH -> dopisani mjesečni segmenti; vraća broj dopisanih redova.
+    Redovi koji su već u segmentu (pad prije brisanja CSV_PATH) se preskaču.
+    """
+    if not os.path.exists(CSV_PATH):
+        return 0
+    po_mjesecu = {}
+    for r in _csv_redovi(CSV_PATH):
+        po_mjesecu.setdefault(mjesec_dnevnika(r["datetime"]), []).append(r)
+    n = 0
+    for mjesec, redovi in po_mjesecu.items():
+        with open(segment_dnevnika(mjesec), "a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            f.seek(0)
+            postojeci = _redovi_gz(mjesec) + list(_csv_redovi_iz(io.StringIO(f.read().decode("utf-8"), newline="")))
+            redovi = _bez_duplikata(redovi, map(_kljuc_reda, postojeci))
+            if not redovi:
+                continue
+            buf = io.StringIO()
+            w = csv.writer(buf)
+            if os.fstat(f.fileno()).st_size == 0:
+                w.writerow(CSV_HEADER)
+            w.writerows([r[k] for k in CSV_HEADER] for r in redovi)
+            f.write(buf.getvalue().encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+            n += len(redovi)
+    os.unlink(CSV_PATH)
+    _fsync_dir(os.path.dirname(CSV_PATH) or ".")
+    return n
+
+def _retencija_dnevnika(indeks, tekuci):
+    """Briše najstarije zatvorene segmente (mjeseci / ukupna veličina); vraća obrisane."""
+    zatvoreni = sorted(m for m in indeks["segmenti"] if m < tekuci)
+    obrisati = []
+    if DNEVNIK_RETENCIJA_MJESECI > 0:
+        granica = _pomjeri_mjesec(tekuci, -DNEVNIK_RETENCIJA_MJESECI)
+        obrisati = [m for m in zatvoreni if m < granica]
+    if DNEVNIK_MAX_MB > 0:
+        ostali = [m for m in zatvoreni if m not in obrisati]
+        ukupno = sum(indeks["segmenti"][m]["bajtova"] for m in ostali) + sum(
+            os.path.getsize(os.path.join(DNEVNIK_DIR, i)) for i in os.listdir(DNEVNIK_DIR) if i.endswith(".csv")
+        )
+        while ostali and ukupno > DNEVNIK_MAX_MB * 1024 * 1024:
+            m = ostali.pop(0)
+            ukupno -= indeks["segmenti"][m]["bajtova"]
+            obrisati.append(m)
+    for m in obrisati:
+        try:
+            os.unlink(segment_dnevnika(m, gz=True))
+        except FileNotFoundError:
+            pass
+        del indeks["segmenti"][m]
+    return obrisati
+
+def _retencija_baze(tekuci, paket=5000):
+    """
+    Ista granica (DNEVNIK_RETENCIJA_MJESECI) važi i za poruke u bazi i
+    njihove ključeve u kontakti; termini ostaju. Briše u paketima (kratke
+    transakcije, upisi sa sajta ne čekaju), pa vraća prostor fajlu:
+    incremental_vacuum, a stara baza bez auto_vacuum se jednom prebaci
+    VACUUM-om. DNEVNIK_MAX_MB se odnosi samo na segmente. Vraća broj poruka.
+    """
+    if DNEVNIK_RETENCIJA_MJESECI <= 0:
+        return 0
+    granica = _granice_mjeseca(_pomjeri_mjesec(tekuci, -DNEVNIK_RETENCIJA_MJESECI))[0]
+    n = 0
+    while True:
+        with transakcija() as con:
+            obrisano = con.execute(
+                "DELETE FROM poruke WHERE id IN (SELECT id FROM poruke WHERE ts_utc < ? LIMIT ?)",
+                (granica, paket),
+            ).rowcount
+        n += obrisano
+        if obrisano < paket:
+            break
+    with transakcija() as con:
+        con.execute("DELETE FROM kontakti WHERE vrsta = 'poruka' AND ts_utc < ?", (granica,))
+    if n:
+        con = db()
+        if con.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            con.execute("PRAGMA incremental_vacuum").fetchall()  # oslobađa stranicu po red rezultata
+        else:
+            con.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            con.execute("VACUUM")
+    return n
+
+def kompaktuj_dnevnik(blokiraj=True):
+    """
+    Razbije stari CSV_PATH, zatvori prošle mjesece u .csv.gz, osvježi
+    index.json i primijeni retenciju (segmenti i poruke u bazi). Jedan
+    proces u isto vrijeme (flock); sa blokiraj=False vraća None ako kompakcija već radi negdje drugo.
+    """
+    os.makedirs(DNEVNIK_DIR, exist_ok=True)
+    with open(os.path.join(DNEVNIK_DIR, ".lock"), "a") as lock:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX | (0 if blokiraj else fcntl.LOCK_NB))
+            except OSError:
+                return None
+        indeks = ucitaj_indeks_dnevnika()
+        tekuci = datetime.now(TZ).strftime("%Y-%m")
+        izvjestaj = {"razbijeno_redova": _razbij_stari_csv(), "kompaktovano": [], "obrisano": []}
+        imena = sorted(os.listdir(DNEVNIK_DIR))
+        # .csv.gz bez zapisa u indeksu (izgubljen index.json) -> indeksiraj ponovo
+        for ime in imena:
+            m = ime[:-len(".csv.gz")]
+            if ime.endswith(".csv.gz") and _MJESEC_RE.match(m) and m not in indeks["segmenti"]:
+                redovi = _redovi_gz(m)
+                if redovi:
+                    indeks["segmenti"][m] = _upisi_segment(m, redovi)
+        for ime in imena:
+            m = ime[:-len(".csv")]
+            if ime.endswith(".csv") and _MJESEC_RE.match(m) and m < tekuci:
+                _kompaktuj_mjesec(m, indeks)
+                izvjestaj["kompaktovano"].append(m)
+        izvjestaj["obrisano"] = _retencija_dnevnika(indeks, tekuci)
+        _upisi_atomicno(DNEVNIK_INDEKS, indeks)
+        izvjestaj["obrisano_iz_baze"] = _retencija_baze(tekuci)
+        return izvjestaj
+
+def citaj_dnevnik(od_utc=None, do_utc=None):
+    """
+    Redovi dnevnika (dict po CSV_HEADER) sa od_utc <= ts < do_utc, mjesec po
+    mjesec. Zatvoreni segmenti se čitaju samo u članovima (danima) iz opsega.
+    """
+    od = od_utc if od_utc is not None else float("-inf")
+    do = do_utc if do_utc is not None else float("inf")
+
+    def u_opsegu(redovi):
+        return (r for r in redovi if od <= _ts_utc(r["datetime"]) < do)
+
+    if os.path.exists(CSV_PATH):  # još nije razbijen
+        yield from u_opsegu(_csv_redovi(CSV_PATH))
+    segmenti = ucitaj_indeks_dnevnika()["segmenti"]
+    try:
+        imena = os.listdir(DNEVNIK_DIR)
+    except FileNotFoundError:
+        imena = []
+    mjeseci = sorted({i[:7] for i in imena if i.endswith((".csv", ".csv.gz")) and _MJESEC_RE.match(i[:7])})
+    for m in mjeseci:
+        pocetak, kraj = _granice_mjeseca(m)
+        if kraj <= od or pocetak >= do:
+            continue
+        seg = segmenti.get(m)
+        if seg and seg["fajl"] in imena and not (seg["do"] < od or seg["od"] >= do):
+            with open(segment_dnevnika(m, gz=True), "rb") as f:
+                for b_od, b_do, off, duz in seg["blokovi"]:
+                    if b_do < od or b_od >= do:
+                        continue
+                    f.seek(off)
+                    tekst = zlib.decompress(f.read(duz), 31).decode("utf-8")
+                    yield from u_opsegu(_csv_redovi_iz(io.StringIO(tekst, newline="")))
+        elif not seg and m + ".csv.gz" in imena:
+            yield from u_opsegu(_redovi_gz(m))
+        if m + ".csv" in imena:
+            try:
+                yield from u_opsegu(_csv_redovi(segment_dnevnika(m)))
+            except FileNotFoundError:
+                pass  # upravo kompaktovan; redovi su u .csv.gz od sljedećeg čitanja
+
+def velicina_dnevnika():
+    """(broj segmenata, bajtova na disku)."""
+    try:
+        imena = [i for i in os.listdir(DNEVNIK_DIR) if i.endswith((".csv", ".csv.gz"))]
+    except FileNotFoundError:
+        return 0, 0
+    return len(imena), sum(os.path.getsize(os.path.join(DNEVNIK_DIR, i)) for i in imena)
+
+def _dnevnik_radnik():
+    while True:
+        try:
+            rez = kompaktuj_dnevnik(blokiraj=False)
+            if rez and (rez["kompaktovano"] or rez["obrisano"] or rez["razbijeno_redova"] or rez["obrisano_iz_baze"]):
+                print(f"Dnevnik: {rez}", flush=True)
+        except Exception as e:
+            print(f"Log compaction error: {e}", flush=True)
+        time.sleep(DNEVNIK_KOMPAKCIJA_S)
+
+def uvezi_csv(path=None, force=False):
+    """
+    Jednokratni uvoz CSV dnevnika u bazu (jedna transakcija). Bez path-a
+    čita cijeli dnevnik (segmenti + stari CSV_PATH ako još postoji).
+    Oznaka u tabeli meta sprječava dupli uvoz; vraća broj uvezenih redova.
+    """
+    if path and not os.path.exists(path):
+        return 0
+    # bez path-a oznaka se upisuje i kad je dnevnik prazan (nova instalacija):
+    # inače bi sljedeći start uvezao redove koje je aplikacija već upisala u bazu
+    izvor = _csv_redovi(path) if path else citaj_dnevnik()
+    with transakcija() as con:
+        if not force and con.execute("SELECT 1 FROM meta WHERE kljuc = 'csv_uvezen'").fetchone():
+            return 0
+        n = 0
+        batch = []
+        for r in izvor:
+            batch.append((r["datetime"], _ts_utc(r["datetime"]), r["ime"], r["kontakt"], r["ip"], r["poruka"]))
+            if len(batch) >= 1000:
+                con.executemany("INSERT INTO poruke (ts, ts_utc, ime, kontakt, ip, poruka) VALUES (?, ?, ?, ?, ?, ?)", batch)
+                n += len(batch)
+                batch = []
+        if batch:
+            con.executemany("INSERT INTO poruke (ts, ts_utc, ime, kontakt, ip, poruka) VALUES (?, ?, ?, ?, ?, ?)", batch)
+            n += len(batch)
+        con.execute(
+            "INSERT OR REPLACE INTO meta (kljuc, vrijednost) VALUES ('csv_uvezen', ?)",
+            (json.dumps({"path": path or DNEVNIK_DIR, "redova": n, "vrijeme": time.time()}),),
+        )
+    return n
+
+def init_db():
+    try:
+        dirpath = os.path.dirname(DB_PATH)
+        if dirpath:
+            os.makedirs(dirpath, exist_ok=True)
+        db().executescript(SHEMA)
+        n = uvezi_csv()
+        if n:
+            print(f"CSV uvezen u bazu: {n} redova", flush=True)
+        n = indeksiraj_kontakte()
+        if n:
+            print(f"Indeks kontakata: {n} ključeva", flush=True)
+    except Exception as e:
+        print(f"DB init error: {e}", flush=True)
+
+init_db()
+
+@app.cli.command("uvezi-csv")
+@click.argument("path", required=False)
+@click.option("--force", is_flag=True, help="Uvezi ponovo i ako je uvoz već rađen.")
+def uvezi_csv_komanda(path, force):
+    """Uvoz CSV dnevnika poruka u SQLite bazu."""
+    n = uvezi_csv(path, force=force)
+    click.echo(f"Uvezeno redova: {n}")
+
+@app.cli.command("indeksiraj-kontakte")
+@click.option("--force", is_flag=True, help="Napravi indeks iznova i ako već postoji.")
+def indeksiraj_kontakte_komanda(force):
+    """Normalizuje kontakte iz svih poruka i termina u indeks (jedan prolaz)."""
+    t0 = time.perf_counter()
+    n = indeksiraj_kontakte(force=force)
+    click.echo(f"Upisano ključeva: {n} ({time.perf_counter() - t0:.2f} s)")
+
+@app.cli.command("kompaktuj-dnevnik")
+def kompaktuj_dnevnik_komanda():
+    """Zatvori prošle mjesece dnevnika u .csv.gz, osvježi indeks, primijeni retenciju (i na bazu)."""
+    rez = kompaktuj_dnevnik()
+    click.echo(json.dumps(rez, ensure_ascii=False))
+    broj, bajtova = velicina_dnevnika()
+    click.echo(f"Segmenata: {broj}, na disku: {bajtova / 1024:.1f} KiB")
+
+@app.cli.command("dnevnik")
+@click.option("--od", help="YYYY-MM-DD (lokalno, uključivo).")
+@click.option("--do", "do_", help="YYYY-MM-DD (lokalno, uključivo).")
+@click.option("--dana", type=int, help="Zadnjih N dana (umjesto --od).")
+def dnevnik_komanda(od, do_, dana):
+    """Ispiše redove dnevnika iz opsega kao CSV (čita samo potrebne segmente)."""
+    od_utc = _dan_u_epoch(od) if od else None
+    if dana:
+        od_utc = int(time.time()) - dana * 86400
+    do_utc = _dan_u_epoch(do_, plus_dana=1) if do_ else None
+    w = csv.writer(click.get_text_stream("stdout"))
+    w.writerow(CSV_HEADER)
+    for r in citaj_dnevnik(od_utc, do_utc):
+        w.writerow([r[k] for k in CSV_HEADER])
+
 # Default radno vrijeme
 RADNO_VRIJEME = {
     "ponedjeljak": {"start": 10, "end": 20},
@@ -112,23 +1079,294 @@ DANI_PUNIM = ["Ponedjeljak", "Utorak", "Srijeda", "Četvrtak", "Petak", "Subota"
 
 def now_podgorica():
     try:
-        return datetime.now(ZoneInfo("Europe/Podgorica"))
+        return datetime.now(TZ)
     except Exception:
         return datetime.now()  # fallback ako nema tzdata
 
-def ucitaj_posebne_datume():
-    try:
-        with open(DATA_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            if isinstance(data, dict):
-                return data
+# ---- keš za JSON fajlove (data.json) ----
+class JsonFajlKes:
+    """
+    Drži parsiran JSON dict u memoriji i ponovo ga čita samo kad se
+    promijeni potpis fajla (mtime_ns, veličina, inode).
+    - os.stat je jedini I/O na vrućoj putanji
+    - drugi gunicorn worker koji upiše fajl mijenja potpis -> svi ga vide
+    - upis je atomski (tmp + rename) pod flock-om na <fajl>.lock, pa
+      read-modify-write iz više workera ne gubi izmjene
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.izmjena_lock = threading.Lock()
+        self.greska = None
+        self.sig = None
+        self.data = {}
+        self.ucitano = False
+        self.verzija = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _potpis(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _procitaj(self):
+        with mjeri("json_load:" + os.path.basename(self.path)):
+            return self._procitaj_fajl()
+
+    def _procitaj_fajl(self):
+        self.greska = None
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+                if isinstance(data, dict):
+                    return data
+                return {}
+        except FileNotFoundError:
             return {}
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {}
+        except json.JSONDecodeError as e:
+            # oštećen fajl: zadrži zadnje ispravno stanje umjesto tihog {}
+            self.greska = f"{os.path.basename(self.path)}: {e}"
+            print(f"JSON read error: {self.greska}", flush=True)
+            return self.data if self.ucitano else {}
+
+    def trenutno(self):
+        """Keširan dict bez kopiranja – samo za čitanje."""
+        sig = self._potpis()
+        with self.lock:
+            if self.ucitano and sig == self.sig:
+                self.hits += 1
+                return self.data
+            self.misses += 1
+            self.data = self._procitaj()
+            self.sig = sig
+            self.ucitano = True
+            self.verzija += 1
+            return self.data
+
+    def get(self):
+        """Vraća plitku kopiju (pozivaoci smiju mijenjati dict)."""
+        return dict(self.trenutno())
+
+    def osvjezi(self):
+        """Provjeri fajl i vrati verziju keša."""
+        self.trenutno()
+        return self.verzija
+
+    def _upisi(self, data):
+        _upisi_atomicno(self.path, data, indent=2)
+        with self.lock:
+            self.data = dict(data)
+            self.sig = self._potpis()
+            self.ucitano = True
+            self.verzija += 1
+            self.greska = None
+
+    @contextlib.contextmanager
+    def _zakljucano(self):
+        with self.izmjena_lock, open(self.path + ".lock", "a") as lf:
+            if fcntl is not None:
+                fcntl.flock(lf.fileno(), fcntl.LOCK_EX)
+            yield
+
+    def set(self, data):
+        """Atomski upis na disk + osvježen keš (bez ponovnog čitanja)."""
+        with self._zakljucano():
+            self._upisi(data)
+
+    @contextlib.contextmanager
+    def izmjena(self):
+        """
+        `with kes.izmjena() as data:` – svježe stanje pod zaključavanjem,
+        izmjene se upisuju jednim atomskim upisom na izlazu (ako nema izuzetka).
+        """
+        with self._zakljucano():
+            data = dict(self.trenutno())
+            if self.greska:
+                raise ValueError(f"Fajl je oštećen, izmjena odbijena ({self.greska}).")
+            yield data
+            self._upisi(data)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "verzija": self.verzija,
+            "ucitano": self.ucitano,
+            "greska": self.greska,
+        }
+
+posebni_kes = JsonFajlKes(DATA_FILE)
+
+def ucitaj_posebne_datume():
+    return posebni_kes.get()
 
 def sacuvaj_posebne_datume(data):
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    posebni_kes.set(data)
+    status_emiter.javi()
+
+@contextlib.contextmanager
+def izmjena_posebnih_datuma():
+    with posebni_kes.izmjena() as data:
+        yield data
+    status_emiter.javi()
+
+# ---- pravila rasporeda (pravila.json) ----
+# Ponavljajuća pravila umjesto unosa datum po datum:
+#   {"tip": "godisnje", "od": "12-25", "do": "12-26", "sati": [null, null]}
+#   {"tip": "godisnje", "od": "08-01", "do": "08-31", "dani": [5], "sati": [null, null]}
+#   {"tip": "raspon", "od": "2025-07-01", "do": "2025-08-31", "sati": [9, 15]}
+# "dani" su 0=pon ... 6=ned (opciono). Kasnije pravilo ima prednost; unos iz
+# data.json za konkretan datum ima prednost nad svim pravilima.
+PRAVILA_FILE = os.path.join(BASE_DIR, "pravila.json")
+pravila_kes = JsonFajlKes(PRAVILA_FILE)
+PRAVILA_TIPOVI = ("godisnje", "raspon")
+
+def _pravilo_vazi(p, d):
+    if p.get("dani") and d.weekday() not in p["dani"]:
+        return False
+    if p.get("tip") == "godisnje":
+        md, od, do = d.strftime("%m-%d"), p["od"], p["do"]
+        return od <= md <= do if od <= do else (md >= od or md <= do)  # npr. 12-24..01-02
+    if p.get("tip") == "raspon":
+        return p["od"] <= d.strftime("%Y-%m-%d") <= p["do"]
+    return False
+
+class KompajliranaPravila:
+    """
+    Pravila kompajlirana u tabelu datum -> (sati, naziv), po godini i lijeno.
+    Pretraga je jedan dict lookup; tabela se briše samo kad se pravila.json
+    promijeni.
+    """
+
+    def __init__(self, kes):
+        self.kes = kes
+        self.lock = threading.Lock()
+        self.verzija = None
+        self.godine = {}
+        self.stats = {"kompajlirano_godina": 0}
+
+    def _godina(self, godina):
+        pravila = self.kes.trenutno().get("pravila") or []
+        tabela = {}
+        d = datetime(godina, 1, 1).date()
+        while d.year == godina:
+            for p in pravila:
+                if _pravilo_vazi(p, d):
+                    tabela[d] = (tuple(p.get("sati") or (None, None)), p.get("naziv") or "")
+            d += timedelta(days=1)
+        self.stats["kompajlirano_godina"] += 1
+        return tabela
+
+    def za_datum(self, d):
+        """(sati, naziv) ili None ako nijedno pravilo ne važi."""
+        v = self.kes.osvjezi()
+        g = self.godine.get(d.year) if v == self.verzija else None
+        if g is None:
+            with self.lock:
+                if v != self.verzija:
+                    self.godine = {}
+                    self.verzija = v
+                g = self.godine.get(d.year)
+                if g is None:
+                    g = self.godine[d.year] = self._godina(d.year)
+        return g.get(d)
+
+pravila_raspored = KompajliranaPravila(pravila_kes)
+
+def ucitaj_pravila():
+    return list(pravila_kes.get().get("pravila") or [])
+
+def sacuvaj_pravila(pravila):
+    pravila_kes.set({"pravila": pravila})
+    status_emiter.javi()
+
+@contextlib.contextmanager
+def izmjena_pravila():
+    with pravila_kes.izmjena() as data:
+        pravila = list(data.get("pravila") or [])
+        yield pravila
+        data["pravila"] = pravila
+    status_emiter.javi()
+
+def _normalizuj_datum(s):
+    """'2027-1-5' / '2027-01-05' -> '2027-01-05'; None ako nije datum."""
+    try:
+        return datetime.strptime(str(s), "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+def pravilo_iz_forme(form):
+    """Validira pravilo iz admin forme; vraća (pravilo, greska)."""
+    tip = (form.get("tip") or "").strip()
+    od = (form.get("od") or "").strip()
+    do = (form.get("do") or "").strip() or od
+    if tip not in PRAVILA_TIPOVI:
+        return None, "Nepoznat tip pravila."
+    fmt = "%m-%d" if tip == "godisnje" else "%Y-%m-%d"
+    # čuva se uvijek sa nulama ("8-1" -> "08-01"), jer _pravilo_vazi poredi stringove
+    if tip == "godisnje":
+        # dozvoli i pun datum iz date pickera -> uzmi mjesec-dan (2000 je prestupna, 02-29 prolazi)
+        od = _normalizuj_datum(od) or _normalizuj_datum("2000-" + od)
+        do = _normalizuj_datum(do) or _normalizuj_datum("2000-" + do)
+    else:
+        od, do = _normalizuj_datum(od), _normalizuj_datum(do)
+    if od is None or do is None:
+        return None, f"Datumi moraju biti u formatu {fmt.replace('%m', 'MM').replace('%d', 'DD').replace('%Y', 'YYYY')}."
+    if tip == "godisnje":
+        od, do = od[5:], do[5:]
+    if tip == "raspon" and do < od:
+        return None, "Kraj raspona je prije početka."
+    dani = sorted({int(x) for x in form.getlist("dani") if x.isdigit() and 0 <= int(x) <= 6})
+    if "neradni" in form:
+        start = end = None
+    else:
+        start = to_int_or_none(form.get("start"))
+        end   = to_int_or_none(form.get("end"))
+        if start is None or end is None:
+            start = end = None
+    return {
+        "id": uuid.uuid4().hex[:8],
+        "naziv": (form.get("naziv") or "").strip(),
+        "tip": tip,
+        "od": od,
+        "do": do,
+        "dani": dani,
+        "sati": [start, end],
+    }, None
+
+def radno_vrijeme_za_datum(d, posebni=None):
+    """
+    (start, end) u satima za dati datum, ili (None, None) za neradni dan.
+    Redoslijed: unos iz data.json za taj datum, pa pravila.json, pa
+    RADNO_VRIJEME po danu.
+    """
+    if posebni is None:
+        posebni = posebni_kes.trenutno()
+    sv = RADNO_VRIJEME.get(DANI_PUNIM[d.weekday()].lower())
+    if sv is None:
+        start, end = None, None
+    else:
+        start, end = sv["start"], sv["end"]
+
+    pr = pravila_raspored.za_datum(d)
+    if pr is not None:
+        start, end = pr[0]
+
+    ps = posebni.get(d.strftime("%Y-%m-%d"))
+    if isinstance(ps, (list, tuple)) and len(ps) == 2:
+        start = ps[0] if ps[0] is not None else None
+        end   = ps[1] if ps[1] is not None else None
+    return start, end
+
+def _lokalno_vrijeme(d, sati):
+    """Datum + sat (može biti 10.5 ili 24) -> aware datetime u Europe/Podgorica."""
+    minuta = to_minutes(sati)
+    dt = datetime(d.year, d.month, d.day) + timedelta(minutes=minuta)
+    return dt.replace(tzinfo=TZ)
 
 def to_int_or_none(x):
     try:
@@ -163,136 +1401,1260 @@ def sat_label(h):
     except Exception:
         return str(h)
 
-# --- kontakt helperi ---
-def is_email(s):
-    if not s:
-        return False
-    return "@" in s and "." in s.split("@")[-1]
+@functools.lru_cache(maxsize=256)
+def _qs_kodirano(s):
+    return urllib.parse.quote_plus(s)
 
-def normalize_phone(raw):
+def build_mailto(to_email: str, subject: str, body: str) -> str:
+    # isto kao urlencode({"subject", "body"}), ali tijela brzih odgovora su
+    # konstante pa se kodiraju samo jednom
+    return f"mailto:{to_email}?subject={_qs_kodirano(subject)}&body={_qs_kodirano(body)}"
+
+# ---- Jinja šabloni za mailove ----
+# Posebno okruženje bez Flask globala (url_for, request, session...): kontekst
+# šablona je tada mali pa je render ~2x brži, i ne traži app/request kontekst
+# (radi i iz mail radnika). Šablon se kompajlira jednom po procesu; statični
+# dijelovi su konstante u kompajliranom kodu, po pozivu se umeću samo polja.
+def _nl2br(s):
+    return Markup(str(escape(s)).replace("\n", "<br>"))
+
+mail_jinja = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(os.path.join(app.root_path, "templates")),
+    autoescape=jinja2.select_autoescape(["html"]),
+    auto_reload=False,
+)
+mail_jinja.filters["nl2br"] = _nl2br
+
+@functools.lru_cache(maxsize=None)
+def mail_sablon(ime):
+    return mail_jinja.get_template(ime)
+
+class PredrenderovanSablon:
     """
-    Normalizuje telefon:
-    - dozvoljava cifre i '+'
-    - 00xx pretvara u +xx
-    - ako počinje nulom bez '+', a DEFAULT_COUNTRY_CODE je postavljen -> doda se pozivni
-    - vraća None ako nema najmanje 7 cifara
+    Šablon čija su jedina promjenljiva mjesta obična `{{ polje }}` umetanja:
+    renderuje se jednom sa markerima i podijeli na statične komade, pa je
+    render po zahtjevu samo join komada i escape-ovanih vrijednosti.
     """
-    if not raw:
-        return None
 
-    # zadrži samo + i cifre
-    s = re.sub(r"[^\d+]", "", raw)
+    def __init__(self, env, ime, polja, **konstante):
+        markeri = {p: Markup(f"\x00{p}\x00") for p in polja}
+        dijelovi = env.get_template(ime).render(**konstante, **markeri).split("\x00")
+        self.staticni = dijelovi[0::2]  # statično, polje, statično, polje, ...
+        self.polja = dijelovi[1::2]
+        self.esc = escape if ime.endswith(".html") else str
+
+    def render(self, **vrijednosti):
+        out = [self.staticni[0]]
+        for polje, komad in zip(self.polja, self.staticni[1:]):
+            out.append(self.esc(vrijednosti.get(polje) or ""))
+            out.append(komad)
+        return "".join(out)
+
+_POLJA_PORUKE = ("ime", "kontakt_val", "tel_uri", "istorija", "poruka", "poruka_html", "ts", "ip",
+                 "confirm_url", "hvala_link", "prosledjujem_link")
+
+@functools.lru_cache(maxsize=None)
+def mail_predrenderovan(ime, polja, kontakt_tip=None, povratnik=False):
+    """Predrenderovan mail šablon po tipu kontakta (email/phone/text) i da li se pacijent vraća."""
+    return PredrenderovanSablon(mail_jinja, ime, polja, kontakt_tip=kontakt_tip, povratnik=povratnik)
+
+# ---- pozadinske niti (jednom po procesu) ----
+_niti = {}
+_niti_lock = threading.Lock()
+
+def pokreni_nit(ime, target):
+    """
+    Pokreće daemon nit jednom po procesu.
+    Sa `gunicorn --preload` modul se učitava u master procesu, a niti ne
+    preživljavaju fork -> zato ih palimo lijeno, u workeru (po PID-u).
+    """
+    pid = os.getpid()
+    t = _niti.get(ime)
+    if t and t[0] == pid and t[1].is_alive():
+        return
+    with _niti_lock:
+        t = _niti.get(ime)
+        if t and t[0] == pid and t[1].is_alive():
+            return
+        nit = threading.Thread(target=target, name=ime, daemon=True)
+        _niti[ime] = (pid, nit)
+        nit.start()
+
+# ---- mail red: spool na disku + pozadinski radnik ----
+# Ruta samo upiše poruku u spool (fsync + rename) i odmah odgovara;
+# radnik šalje, a neuspjele pokušaje ponavlja sa eksponencijalnim backoff-om.
+# Za lokalno testiranje: SMTP_HOST=127.0.0.1 SMTP_PORT=1025 SMTP_SSL=0
+# (vidi tools/fake_smtp.py).
+MAIL_SPOOL_DIR = os.environ.get("MAIL_SPOOL_DIR") or os.path.join(
+    os.path.dirname(CSV_PATH) or app.instance_path, "mail_spool"
+)
+SMTP_HOST = os.environ.get("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "465"))
+SMTP_SSL = os.environ.get("SMTP_SSL", "1") != "0"
+SMTP_TIMEOUT = float(os.environ.get("SMTP_TIMEOUT", "30"))
+MAIL_MAX_POKUSAJA = int(os.environ.get("MAIL_MAX_POKUSAJA", "8"))
+MAIL_BACKOFF_S = float(os.environ.get("MAIL_BACKOFF_S", "15"))
+MAIL_BACKOFF_MAX_S = float(os.environ.get("MAIL_BACKOFF_MAX_S", "1800"))
+MAIL_POLL_S = float(os.environ.get("MAIL_POLL_S", "5"))
+
+MAIL_STATS = {"u_red": 0, "poslato": 0, "greske": 0, "odustato": 0}
+mail_budjenje = threading.Event()
+
+def gmail_kredencijali():
+    user = os.environ.get("GMAIL_USER")
+    app_pw = (os.environ.get("GMAIL_APP_PASSWORD") or "").replace(" ", "")
+    return user, app_pw
 
-    if not s:
-        return None
+def _spool_dir(ime):
+    p = os.path.join(MAIL_SPOOL_DIR, ime)
+    os.makedirs(p, exist_ok=True)
+    return p
 
-    # 00xx -> +xx
-    if s.startswith("00"):
-        s = "+" + s[2:]
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def _upisi_atomicno(path, data, indent=None):
+    """tmp fajl + fsync + os.replace -> fajl je ili stari ili novi, nikad pola."""
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(os.path.dirname(path))
+
+def stavi_u_red(msg, opis=""):
+    """Trajno upiše EmailMessage u spool i probudi radnika. Vraća id."""
+    mail_id = f"{time.time_ns()}-{uuid.uuid4().hex[:8]}"
+    zapis = {
+        "id": mail_id,
+        "opis": opis,
+        "naslov": str(msg.get("Subject", "")),
+        "za": str(msg.get("To", "")),
+        "kreirano": time.time(),
+        "pokusaja": 0,
+        "sljedeci": 0,
+        "greska": "",
+        "eml": base64.b64encode(msg.as_bytes()).decode("ascii"),
+    }
+    _upisi_atomicno(os.path.join(_spool_dir("pending"), mail_id + ".json"), zapis)
+    MAIL_STATS["u_red"] += 1
+    pokreni_nit("mail-red", _mail_radnik)
+    mail_budjenje.set()
+    return mail_id
+
+# ---- SMTP pool: ponovna upotreba autentifikovanih sesija ----
+# TLS handshake + login su skoro sva latencija slanja; sesiju čuvamo otvorenu
+# SMTP_IDLE_S sekundi, prije ponovne upotrebe provjerimo je sa NOOP.
+SMTP_POOL_MAX = int(os.environ.get("SMTP_POOL_MAX", "2"))
+SMTP_IDLE_S = float(os.environ.get("SMTP_IDLE_S", "60"))
+
+_ssl_ctx = None
+
+def ssl_kontekst():
+    """Jedan SSL kontekst po procesu (učitavanje CA bundle-a nije jeftino)."""
+    global _ssl_ctx
+    if _ssl_ctx is None:
+        import ssl
+        _ssl_ctx = ssl.create_default_context()
+    return _ssl_ctx
+
+class SmtpPool:
+    def __init__(self, max_konekcija=2, idle_s=60.0):
+        self.max_konekcija = max_konekcija
+        self.idle_s = idle_s
+        self.lock = threading.Lock()
+        self.slobodne = []  # [(smtp, monotonic zadnje upotrebe)]
+        self.stats = {"nove": 0, "ponovo": 0, "reciklirane": 0, "prekinute": 0}
+        self.vremena = {}   # korak -> {"n", "ukupno_s", "max_s", "zadnje_s"}
+
+    def _mjeri(self, korak, t0):
+        dt = time.perf_counter() - t0
+        KORACI_HIST.observe("smtp_" + korak, dt)
+        with self.lock:
+            v = self.vremena.setdefault(korak, {"n": 0, "ukupno_s": 0.0, "max_s": 0.0, "zadnje_s": 0.0})
+            v["n"] += 1
+            v["ukupno_s"] += dt
+            v["max_s"] = max(v["max_s"], dt)
+            v["zadnje_s"] = dt
+
+    def _nova(self):
+        import smtplib
+        user, app_pw = gmail_kredencijali()
+        t0 = time.perf_counter()
+        if SMTP_SSL:
+            smtp = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, context=ssl_kontekst(), timeout=SMTP_TIMEOUT)
+        else:
+            smtp = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        smtp.ehlo()
+        self._mjeri("connect", t0)
+        if user and app_pw and smtp.has_extn("auth"):
+            t0 = time.perf_counter()
+            smtp.login(user, app_pw)
+            self._mjeri("login", t0)
+        self.stats["nove"] += 1
+        return smtp
+
+    @staticmethod
+    def _zatvori(smtp):
+        try:
+            smtp.quit()
+        except Exception:
+            try:
+                smtp.close()
+            except Exception:
+                pass
+
+    def _uzmi(self):
+        """Vraća (smtp, ponovo_koristena)."""
+        import smtplib
+        while True:
+            with self.lock:
+                if not self.slobodne:
+                    break
+                smtp, zadnje = self.slobodne.pop()
+            if time.monotonic() - zadnje > self.idle_s:
+                self.stats["reciklirane"] += 1
+                self._zatvori(smtp)
+                continue
+            try:
+                if smtp.noop()[0] == 250:
+                    self.stats["ponovo"] += 1
+                    return smtp, True
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.stats["prekinute"] += 1
+            self._zatvori(smtp)
+        return self._nova(), False
+
+    def _vrati(self, smtp):
+        with self.lock:
+            if len(self.slobodne) < self.max_konekcija:
+                self.slobodne.append((smtp, time.monotonic()))
+                return
+        self._zatvori(smtp)
+
+    def posalji(self, msg):
+        import smtplib
+        smtp, ponovo = self._uzmi()
+        t0 = time.perf_counter()
+        try:
+            smtp.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            self.stats["prekinute"] += 1
+            self._zatvori(smtp)
+            if not ponovo:
+                raise
+            # server je zatvorio sesiju između NOOP-a i slanja -> jednom iznova
+            smtp = self._nova()
+            t0 = time.perf_counter()
+            try:
+                smtp.send_message(msg)
+            except BaseException:
+                self._zatvori(smtp)
+                raise
+        except smtplib.SMTPResponseException:
+            # server je odbio poruku, ali sesija je ispravna (smtplib radi RSET)
+            self._vrati(smtp)
+            raise
+        except BaseException:
+            self._zatvori(smtp)
+            raise
+        self._mjeri("send", t0)
+        self._vrati(smtp)
+
+    def ocisti(self):
+        """Zatvara sesije koje su predugo neaktivne (zove ga mail radnik)."""
+        granica = time.monotonic() - self.idle_s
+        with self.lock:
+            stare = [s for s, t in self.slobodne if t < granica]
+            self.slobodne = [(s, t) for s, t in self.slobodne if t >= granica]
+        for smtp in stare:
+            self.stats["reciklirane"] += 1
+            self._zatvori(smtp)
+
+    def pregled(self):
+        with self.lock:
+            vremena = {k: dict(v, prosjek_s=v["ukupno_s"] / v["n"]) for k, v in self.vremena.items()}
+            otvorene = len(self.slobodne)
+        return dict(self.stats, otvorene=otvorene, vremena=vremena)
+
+smtp_pool = SmtpPool(SMTP_POOL_MAX, SMTP_IDLE_S)
+
+def smtp_posalji(msg):
+    smtp_pool.posalji(msg)
+
+def _backoff(pokusaja):
+    return min(MAIL_BACKOFF_S * (2 ** max(pokusaja - 1, 0)), MAIL_BACKOFF_MAX_S)
+
+def _obradi_jedan(path):
+    """
+    Pokušaj slanja jedne poruke iz spool-a.
+    flock sprječava da dva workera šalju isti fajl; provjera inode-a hvata
+    slučaj kad je fajl u međuvremenu prepisan (novi pokušaj).
+    """
+    try:
+        f = open(path, "r", encoding="utf-8")
+    except FileNotFoundError:
+        return
+    with f:
+        if fcntl is not None:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return
+        try:
+            if os.fstat(f.fileno()).st_ino != os.stat(path).st_ino:
+                return
+            zapis = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        if zapis.get("sljedeci", 0) > time.time():
+            return zapis["sljedeci"]
+
+        try:
+            import email, email.policy
+            msg = email.message_from_bytes(base64.b64decode(zapis["eml"]), policy=email.policy.default)
+            smtp_posalji(msg)
+        except Exception as e:
+            zapis["pokusaja"] = zapis.get("pokusaja", 0) + 1
+            zapis["greska"] = f"{type(e).__name__}: {e}"
+            MAIL_STATS["greske"] += 1
+            print(f"Mail error ({zapis.get('opis')}, pokušaj {zapis['pokusaja']}): {e}", flush=True)
+            if zapis["pokusaja"] >= MAIL_MAX_POKUSAJA:
+                _upisi_atomicno(os.path.join(_spool_dir("failed"), os.path.basename(path)), zapis)
+                os.remove(path)
+                MAIL_STATS["odustato"] += 1
+            else:
+                zapis["sljedeci"] = time.time() + _backoff(zapis["pokusaja"])
+                _upisi_atomicno(path, zapis)
+                return zapis["sljedeci"]
+            return
+
+        os.remove(path)
+        MAIL_STATS["poslato"] += 1
+
+def obradi_mail_red():
+    """Prođe kroz spool; vraća najraniji rok sljedećeg ponovnog pokušaja (ili None)."""
+    pending = _spool_dir("pending")
+    najraniji = None
+    for ime in sorted(os.listdir(pending)):
+        if ime.endswith(".json"):
+            rok = _obradi_jedan(os.path.join(pending, ime))
+            if rok is not None and (najraniji is None or rok < najraniji):
+                najraniji = rok
+    return najraniji
+
+def _mail_radnik():
+    while True:
+        cekaj = MAIL_POLL_S
+        try:
+            rokovi = [obradi_digest(), obradi_mail_red()]
+            rok = min((r for r in rokovi if r is not None), default=None)
+            if rok is not None:
+                cekaj = max(0.05, min(cekaj, rok - time.time()))
+        except Exception as e:
+            print(f"Mail queue error: {e}", flush=True)
+        smtp_pool.ocisti()
+        mail_budjenje.wait(cekaj)
+        mail_budjenje.clear()
+
+def mail_red_pregled():
+    """Lista poruka na čekanju i neuspjelih (bez sadržaja)."""
+    out = {}
+    for stanje in ("pending", "failed"):
+        d = _spool_dir(stanje)
+        stavke = []
+        for ime in sorted(os.listdir(d)):
+            if not ime.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(d, ime), "r", encoding="utf-8") as f:
+                    z = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+            z.pop("eml", None)
+            stavke.append(z)
+        out[stanje] = stavke
+    return out
+
+@app.before_request
+def _pozadinske_niti():
+    # poruke zaostale u spool-u (npr. nakon restarta) šalju se bez čekanja na novu
+    pokreni_nit("mail-red", _mail_radnik)
+    # i podsjetnici propušteni dok je instanca spavala
+    pokreni_nit("podsjetnici", _podsjetnik_radnik)
+    pokreni_nit("dnevnik", _dnevnik_radnik)
+
+# ---- mail za kontakt poruku: pojedinačno ili digest ----
+# Sa MAIL_DIGEST=1 poruke se skupljaju u spool/digest i šalju kao jedan mail
+# kad prođe MAIL_DIGEST_S od najstarije ili kad ih bude MAIL_DIGEST_MAX;
+# broj SMTP sesija tada raste sa vremenom, ne sa brojem poruka.
+MAIL_ZA = "dentalabplaner@gmail.com"
+MAIL_DIGEST = os.environ.get("MAIL_DIGEST", "0") == "1"
+MAIL_DIGEST_S = float(os.environ.get("MAIL_DIGEST_S", "600"))
+MAIL_DIGEST_MAX = int(os.environ.get("MAIL_DIGEST_MAX", "20"))
+HVALA_TELO = "Hvala Vam na javljanju. Uskoro ćemo se povratno javiti.\n\n— DENTALAB"
+PROSLEDJUJEM_TELO = (
+    "Vašu poruku smo prosledili nadležnom timu/doktoru. "
+    "Javićemo Vam se čim dobijemo povratnu informaciju.\n\n— DENTALAB"
+)
+
+def kontakt_stavka(ime, kontakt, poruka, ts, ip, url_base, istorija=""):
+    """
+    Tekst, HTML blok i podaci o kontaktu za jednu poruku (isti i u digestu).
+    istorija: opis_istorije(...) pošiljaoca ili "" za novog.
+    """
+    vrijeme = datetime.fromisoformat(ts)
+    kontakt_tip, kontakt_val = classify_kontakt(kontakt)
 
-    # saniraj višak '+'
-    if s.count("+") > 1:
-        s = re.sub(r"\++", "+", s)
-    if "+" in s[1:]:
-        s = s[0] + s[1:].replace("+", "")
+    # link za prefill potvrde termina
+    confirm_qs = urllib.parse.urlencode({
+        "ime": ime or "",
+        "email": kontakt_val if (kontakt_tip == "email") else "",
+        "telefon": kontakt_val if (kontakt_tip == "phone") else "",
+        "ref": f"Ref: poruka sa sajta {vrijeme.strftime('%d.%m.%Y %H:%M')}",
+    })
 
-    # ako počinje '0' i nema '+', dodaj pozivni (ako je definisan)
-    if s.startswith("0") and not s.startswith("+") and DEFAULT_COUNTRY_CODE:
-        s = DEFAULT_COUNTRY_CODE + s.lstrip("0")
+    # brzi odgovori
+    quick_reply_to = kontakt_val if (kontakt_tip == "email" and kontakt_val) else MAIL_ZA
+    oslovljavanje = ime or "poštovani/na"
+    sadrzaj = {
+        "ime": ime or "—", "poruka": poruka, "poruka_html": _nl2br(poruka), "ts": ts, "ip": ip,
+        "kontakt_val": kontakt_val or "—",
+        "tel_uri": "tel:" + _NE_TELEFON_RE.sub("", kontakt_val) if kontakt_tip == "phone" else "",
+        "istorija": istorija,
+        "confirm_url": f"{url_base}/potvrdi_termin?{confirm_qs}",
+        "hvala_link": build_mailto(quick_reply_to, f"Hvala na poruci – {oslovljavanje}", HVALA_TELO),
+        "prosledjujem_link": build_mailto(quick_reply_to, f"Vaša poruka je prosleđena – {oslovljavanje}", PROSLEDJUJEM_TELO),
+    }
+    return {
+        "ime": ime, "vrijeme": vrijeme, "kontakt_tip": kontakt_tip, "kontakt_val": kontakt_val,
+        "txt": mail_predrenderovan("mail/poruka.txt", _POLJA_PORUKE, kontakt_tip, bool(istorija)).render(**sadrzaj),
+        "html": Markup(mail_predrenderovan("mail/poruka_blok.html", _POLJA_PORUKE, kontakt_tip,
+                                           bool(istorija)).render(**sadrzaj)),
+    }
+
+def nova_poruka(od, user, za=MAIL_ZA):
+    """EmailMessage sa From/To (email paket se uvozi tek ovdje)."""
+    from email.message import EmailMessage
+    from email.utils import formataddr
+    msg = EmailMessage()
+    msg["From"] = formataddr((od, user))
+    msg["To"] = za
+    return msg
+
+def mail_za_poruku(st, user):
+    msg = nova_poruka("PORUKA SA SAJTA", user)
+    msg["Subject"] = f"[Kontakt sa sajta] {st['ime'] or 'Anonimno'} — {st['vrijeme'].strftime('%d.%m.%Y %H:%M')}"
+    msg.set_content(st["txt"])
+    msg.add_alternative(mail_predrenderovan("mail/poruka.html", ("blok",)).render(blok=st["html"]), subtype="html")
+
+    if st["kontakt_tip"] == "email" and st["kontakt_val"]:
+        msg["Reply-To"] = st["kontakt_val"]
+    if st["kontakt_tip"] == "phone" and st["kontakt_val"]:
+        msg["X-Contact-Phone"] = st["kontakt_val"]
+    return msg
+
+def mail_digest(stavke, user):
+    """Jedan mail za više poruka; svaka zadržava svoje brze odgovore i "Potvrdi termin"."""
+    if len(stavke) == 1:
+        return mail_za_poruku(stavke[0], user)
+    od, do = stavke[0]["vrijeme"], stavke[-1]["vrijeme"]
+    msg = nova_poruka("PORUKA SA SAJTA", user)
+    msg["Subject"] = f"[Kontakt sa sajta] {len(stavke)} poruka — {od.strftime('%d.%m.%Y %H:%M')}–{do.strftime('%H:%M')}"
+    razmak = "\n" + "-" * 40 + "\n\n"
+    msg.set_content(razmak.join(f"#{i} {st['txt']}" for i, st in enumerate(stavke, 1)))
+    msg.add_alternative(mail_sablon("mail/digest.html").render(stavke=stavke), subtype="html")
+    return msg
+
+def dodaj_u_digest(podaci):
+    """Trajno sačuva podatke poruke (kwargs za kontakt_stavka) za sljedeći digest."""
+    ime = f"{time.time_ns()}-{uuid.uuid4().hex[:8]}.json"
+    _upisi_atomicno(os.path.join(_spool_dir("digest"), ime), podaci)
+    pokreni_nit("mail-red", _mail_radnik)
+    mail_budjenje.set()
+
+def obradi_digest():
+    """
+    Složi digest u pending/ kad je vrijeme (prozor istekao ili MAIL_DIGEST_MAX
+    poruka). Vraća rok sljedeće provjere ili None. Ako proces padne između
+    upisa digesta i brisanja stavki, stavke stignu još jednom (nikad izgubljene).
+    """
+    d = _spool_dir("digest")
+    with open(os.path.join(d, ".lock"), "a") as lock:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return None  # drugi worker upravo pravi digest
+        while True:
+            imena = sorted(i for i in os.listdir(d) if i.endswith(".json"))
+            if not imena:
+                return None
+            rok = int(imena[0].split("-", 1)[0]) / 1e9 + MAIL_DIGEST_S
+            if len(imena) < MAIL_DIGEST_MAX and time.time() < rok:
+                return rok
+            imena = imena[:MAIL_DIGEST_MAX]
+            stavke = []
+            for ime in imena:
+                try:
+                    with open(os.path.join(d, ime), "r", encoding="utf-8") as f:
+                        stavke.append(kontakt_stavka(**json.load(f)))
+                except (FileNotFoundError, json.JSONDecodeError, TypeError) as e:
+                    print(f"Digest: preskačem {ime}: {e}", flush=True)
+            user, _ = gmail_kredencijali()
+            if stavke:
+                stavi_u_red(mail_digest(stavke, user), opis=f"kontakt-digest ({len(stavke)})")
+            for ime in imena:
+                try:
+                    os.remove(os.path.join(d, ime))
+                except FileNotFoundError:
+                    pass
+
+# ---- vremenska linija otvoreno/zatvoreno ----
+# Prelazi (otvaranje/zatvaranje) za narednih TIMELINE_DANA dana, izračunati
+# jednom iz RADNO_VRIJEME + data.json (DST riješen kroz ZoneInfo). Gradi se
+# ponovo samo kad se promijeni raspored ili datum.
+TIMELINE_DANA = int(os.environ.get("TIMELINE_DANA", "14"))
+STATUS_MAX_AGE_MAX = int(os.environ.get("STATUS_MAX_AGE_MAX", "3600"))
+
+def raspored_verzija():
+    """Token koji se mijenja sa svakom izmjenom rasporeda (data.json, pravila.json)."""
+    return (posebni_kes.osvjezi(), pravila_kes.osvjezi())
+
+class VremenskaLinija:
+    def __init__(self, dana=14):
+        self.dana = dana
+        self.lock = threading.Lock()
+        self.kljuc = None
+        # (trenuci, prelazi, dani) se mijenja jednom dodjelom, a status() ga
+        # čita jednom -> čitalac bez lock-a nikad ne vidi pola stare i pola nove linije
+        # trenuci: sortirani aware datetime-ovi prelaza
+        # prelazi: (trenutak, otvoreno_poslije)
+        # dani:    datum -> (start, end) ili (None, None)
+        self.linija = ([], [], {})
+        self.stats = {"gradnje": 0}
+
+    def _izgradi(self, danas):
+        posebni = posebni_kes.trenutno()
+        prelazi, dani = [], {}
+        for i in range(-1, self.dana + 1):
+            d = danas + timedelta(days=i)
+            start, end = radno_vrijeme_za_datum(d, posebni)
+            start_m, end_m = to_minutes(start), to_minutes(end)
+            if start_m is None or end_m is None:
+                dani[d] = (None, None)
+                continue
+            dani[d] = (start, end)
+            if start_m < end_m:
+                prelazi.append((_lokalno_vrijeme(d, start), True))
+                prelazi.append((_lokalno_vrijeme(d, end), False))
+        prelazi.sort(key=lambda p: p[0])
+        self.linija = ([p[0] for p in prelazi], prelazi, dani)
+        self.stats["gradnje"] += 1
+
+    def _osvjezi(self, sada):
+        kljuc = (raspored_verzija(), sada.date())
+        if kljuc != self.kljuc:
+            with self.lock:
+                if kljuc != self.kljuc:
+                    self._izgradi(sada.date())
+                    self.kljuc = kljuc
+
+    def status(self, sada=None):
+        """
+        Stanje u trenutku `sada`:
+        {otvoreno, start, end (današnji sati), sljedeca_promjena (datetime ili None)}
+        """
+        sada = sada or now_podgorica()
+        self._osvjezi(sada)
+        trenuci, prelazi, dani = self.linija
+        i = bisect.bisect_right(trenuci, sada)
+        otvoreno = prelazi[i - 1][1] if i > 0 else False
+        start, end = dani.get(sada.date(), (None, None))
+        return {
+            "otvoreno": otvoreno,
+            "start": start,
+            "end": end,
+            "sljedeca_promjena": trenuci[i] if i < len(trenuci) else None,
+        }
+
+vremenska_linija = VremenskaLinija(TIMELINE_DANA)
+
+def status_poruka(st):
+    """(poruka_html, poruka_tts, status_slika) za stanje iz vremenske linije."""
+    start, end = st["start"], st["end"]
+    if start is None or end is None:
+        return "Danas je neradni dan.", "Danas je neradni dan.", "close1.png"
+    if st["otvoreno"]:
+        linije = [
+            "Ordinacija je trenutno otvorena.",
+            f"Danas je radno vrijeme od {sat_label(start)} do {sat_label(end)} časova."
+        ]
+        status_slika = "open.png"
+    else:
+        linije = [
+            "Ordinacija je trenutno zatvorena.",
+            f"Danas je radno vrijeme od {sat_label(start)} do {sat_label(end)} časova."
+        ]
+        status_slika = "close1.png"
+    return "<br>".join(linije), " ".join(linije), status_slika
 
-    # minimalno 7 cifara
-    digits = re.sub(r"\D", "", s)
-    if len(digits) < 7:
+def _sekundi_do(st, sada):
+    """Sekunde do sljedećeg prelaza (None ako ga nema u horizontu linije)."""
+    sljedeca = st["sljedeca_promjena"]
+    if sljedeca is None:
         return None
+    return max(1, math.ceil((sljedeca - sada).total_seconds()))
 
-    return s
+@app.get("/api/status")
+def api_status():
+    sada = now_podgorica()
+    st = vremenska_linija.status(sada)
+    _, poruka_tts, _ = status_poruka(st)
+    do_promjene = _sekundi_do(st, sada)
+    sljedeca = st["sljedeca_promjena"]
+    resp = jsonify(
+        otvoreno=st["otvoreno"],
+        neradni_dan=st["start"] is None or st["end"] is None,
+        danas={"start": st["start"], "end": st["end"]},
+        poruka=poruka_tts,
+        kljuc=status_kljuc(st),
+        sljedeca_promjena=sljedeca.isoformat() if sljedeca else None,
+        sekundi_do_promjene=do_promjene,
+    )
+    # keš važi do sljedećeg otvaranja/zatvaranja (ograničeno zbog izmjena rasporeda)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = min(do_promjene or STATUS_MAX_AGE_MAX, STATUS_MAX_AGE_MAX)
+    return resp
+
+# ---- SSE: guranje statusa (/status/stream) ----
+# Jedna nit po procesu spava do sljedećeg prelaza iz vremenske linije (ili do
+# izmjene rasporeda) i tek tada šalje događaj svim pretplatnicima; između
+# toga ide samo heartbeat komentar. Cijena nije mala: svaka otvorena
+# konekcija zauzima jednu gthread nit workera dok je klijent otvoren, a
+# render.yaml ima --threads 16. Zato je limit nizak (4 -> ostaje 12 niti za
+# ostatak sajta). Zato stream koriste samo ekrani otvoreni sa /?display=1
+# (čekaonica, recepcija); obični posjetioci pollaju /api/status, koji šalje
+# max-age do sljedećeg prelaza. Preko limita -> 503 i ekran pada na polling.
+SSE_HEARTBEAT_S = float(os.environ.get("SSE_HEARTBEAT_S", "25"))
+SSE_MAX_PRETPLATNIKA = int(os.environ.get("SSE_MAX_PRETPLATNIKA", "4"))
+
+def status_kljuc(st):
+    """Kratak opis stanja; stranica se osvježi samo kad se on promijeni."""
+    return f"{int(st['otvoreno'])}|{st['start']}|{st['end']}"
+
+class StatusEmiter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pretplatnici = set()
+        self.budjenje = threading.Event()
+        self.zadnji = None
+        self.stats = {"dogadjaja": 0, "heartbeat": 0, "odbijeno": 0}
+
+    def _dogadjaj(self):
+        st = vremenska_linija.status()
+        _, poruka_tts, _ = status_poruka(st)
+        sljedeca = st["sljedeca_promjena"]
+        return json.dumps({
+            "kljuc": status_kljuc(st),
+            "otvoreno": st["otvoreno"],
+            "poruka": poruka_tts,
+            "sljedeca_promjena": sljedeca.isoformat() if sljedeca else None,
+        }, ensure_ascii=False)
+
+    def pretplati(self):
+        with self.lock:
+            if len(self.pretplatnici) >= SSE_MAX_PRETPLATNIKA:
+                self.stats["odbijeno"] += 1
+                return None, None
+            q = queue.Queue(maxsize=16)
+            self.pretplatnici.add(q)
+        pokreni_nit("sse-status", self._petlja)
+        # početni događaj uvijek svjež: self.zadnji može kasniti (izmjena
+        # rasporeda u drugom procesu) pa bi klijent dobio stari ključ i
+        # osvježavao stranicu u krug; zadnji ne diramo da petlja ostalima
+        # ipak pošalje promjenu
+        return q, self._dogadjaj()
+
+    def odjavi(self, q):
+        with self.lock:
+            self.pretplatnici.discard(q)
+
+    def javi(self):
+        """Raspored je izmijenjen u ovom procesu -> provjeri odmah."""
+        self.budjenje.set()
+
+    def _posalji_svima(self, poruka):
+        with self.lock:
+            pretplatnici = list(self.pretplatnici)
+        for q in pretplatnici:
+            try:
+                q.put_nowait(poruka)
+            except queue.Full:
+                pass  # spor klijent; dobiće sljedeći događaj
+
+    def _petlja(self):
+        while True:
+            try:
+                podaci = self._dogadjaj()
+                if podaci != self.zadnji:
+                    self.zadnji = podaci
+                    self.stats["dogadjaja"] += 1
+                    self._posalji_svima(f"event: status\ndata: {podaci}\n\n")
+                else:
+                    self.stats["heartbeat"] += 1
+                    self._posalji_svima(": ping\n\n")
+                sada = now_podgorica()
+                do = _sekundi_do(vremenska_linija.status(sada), sada)
+                cekaj = min(SSE_HEARTBEAT_S, do if do is not None else SSE_HEARTBEAT_S)
+            except Exception as e:
+                print(f"SSE error: {e}", flush=True)
+                cekaj = SSE_HEARTBEAT_S
+            self.budjenje.wait(cekaj)
+            self.budjenje.clear()
+
+status_emiter = StatusEmiter()
+
+@app.get("/status/stream")
+def status_stream():
+    q, pocetno = status_emiter.pretplati()
+    if q is None:
+        return Response("Previše pretplatnika.", status=503, headers={"Retry-After": "60"})
+
+    def stream():
+        try:
+            yield f"retry: 5000\nevent: status\ndata: {pocetno}\n\n"
+            while True:
+                try:
+                    yield q.get(timeout=SSE_HEARTBEAT_S * 3)
+                except queue.Empty:
+                    return  # emiter ne radi -> klijent će se ponovo spojiti
+        finally:
+            status_emiter.odjavi(q)
 
-def classify_kontakt(k):
+    return Response(
+        stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# ---- slobodni termini (/api/slots) ----
+# Indeks zauzetih intervala po danu (sortirane liste, bisect). Termini se samo
+# dodaju, pa se indeks dopunjava novim redovima (id > zadnji viđeni) kad se
+# promijeni termini_verzija; nema ponovnog čitanja cijele tabele.
+TERMIN_TRAJANJE_MIN = int(os.environ.get("TERMIN_TRAJANJE_MIN", "60"))
+SLOT_KORAK_MIN = int(os.environ.get("SLOT_KORAK_MIN", "30"))
+SLOTS_MAX_DANA = 92
+
+class TerminiIndeks:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.verzija = None
+        self.zadnji_id = 0
+        self.pocetci = {}  # datum -> sortirani početci (minute od ponoći)
+        self.maks_kraj = {}  # datum -> max kraja za pocetci[0..i] (prefiksni maksimum)
+
+    def _dodaj(self, start_utc, trajanje_min):
+        start = datetime.fromtimestamp(start_utc, TZ)
+        d = start.date()
+        s = start.hour * 60 + start.minute
+        p = self.pocetci.setdefault(d, [])
+        m = self.maks_kraj.setdefault(d, [])
+        i = bisect.bisect_right(p, s)
+        p.insert(i, s)
+        m.insert(i, 0)
+        # prefiksni maksimum od i nadalje (termina po danu je malo)
+        prije = m[i - 1] if i > 0 else 0
+        m[i] = max(prije, s + trajanje_min)
+        for j in range(i + 1, len(m)):
+            m[j] = max(m[j - 1], m[j])
+
+    def _osvjezi(self):
+        v = termini_verzija()
+        if v == self.verzija:
+            return
+        with self.lock:
+            if v == self.verzija:
+                return
+            for r in db().execute(
+                "SELECT id, start_utc, trajanje_min FROM termini WHERE id > ? ORDER BY id",
+                (self.zadnji_id,),
+            ):
+                self._dodaj(r["start_utc"], r["trajanje_min"])
+                self.zadnji_id = r["id"]
+            self.verzija = v
+
+    def zauzeto(self, d, s, e):
+        """Da li se [s, e) (minute) preklapa sa nekim terminom tog dana. O(log n)."""
+        p = self.pocetci.get(d)
+        if not p:
+            return False
+        # termini koji počinju prije kraja intervala; preklapanje postoji ako
+        # se bilo koji od njih završava poslije početka intervala
+        i = bisect.bisect_left(p, e)
+        return i > 0 and self.maks_kraj[d][i - 1] > s
+
+    def slobodni(self, d, posebni=None, trajanje=TERMIN_TRAJANJE_MIN, korak=SLOT_KORAK_MIN, od_minute=0):
+        """Lista 'HH:MM' početaka koji staju u radno vrijeme i nisu zauzeti."""
+        self._osvjezi()
+        start, end = radno_vrijeme_za_datum(d, posebni)
+        start_m, end_m = to_minutes(start), to_minutes(end)
+        if start_m is None or end_m is None:
+            return []
+        out = []
+        s = start_m
+        while s + trajanje <= end_m:
+            if s >= od_minute and not self.zauzeto(d, s, s + trajanje):
+                out.append(f"{s // 60:02d}:{s % 60:02d}")
+            s += korak
+        return out
+
+termini_indeks = TerminiIndeks()
+
+def termin_van_radnog_vremena(dt_local, trajanje_min):
+    """Razlog odbijanja (string) ili None ako termin staje u radno vrijeme."""
+    if dt_local <= now_podgorica():
+        return "Termin je u prošlosti."
+    start, end = radno_vrijeme_za_datum(dt_local.date())
+    start_m, end_m = to_minutes(start), to_minutes(end)
+    if start_m is None or end_m is None:
+        return "Taj dan ordinacija ne radi."
+    s = dt_local.hour * 60 + dt_local.minute
+    if s < start_m or s + trajanje_min > end_m:
+        return f"Termin mora biti u radnom vremenu ({sat_label(start)}–{sat_label(end)})."
+    return None
+
+def rezervisi_termin(dt_local, trajanje_min, **podaci):
+    """Provjera radnog vremena + upis bez preklapanja (TerminNijeSlobodan)."""
+    razlog = termin_van_radnog_vremena(dt_local, trajanje_min)
+    if razlog:
+        raise TerminNijeSlobodan(razlog)
+    return sacuvaj_termin(dt_local, trajanje_min, provjeri_preklapanje=True, **podaci)
+
+@app.get("/api/slots")
+def api_slots():
+    danas = now_podgorica()
+    try:
+        od = datetime.strptime(request.args.get("from") or danas.strftime("%Y-%m-%d"), "%Y-%m-%d").date()
+        do = datetime.strptime(request.args.get("to") or od.strftime("%Y-%m-%d"), "%Y-%m-%d").date()
+    except ValueError:
+        return jsonify(error="from/to moraju biti YYYY-MM-DD"), 400
+    od = max(od, danas.date())
+    if do < od:
+        return jsonify(korak=SLOT_KORAK_MIN, trajanje=TERMIN_TRAJANJE_MIN, dani={})
+    do = min(do, od + timedelta(days=SLOTS_MAX_DANA - 1))
+
+    posebni = ucitaj_posebne_datume()
+    dani = {}
+    d = od
+    while d <= do:
+        od_minute = danas.hour * 60 + danas.minute + 1 if d == danas.date() else 0
+        dani[d.strftime("%Y-%m-%d")] = termini_indeks.slobodni(d, posebni, od_minute=od_minute)
+        d += timedelta(days=1)
+    resp = jsonify(korak=SLOT_KORAK_MIN, trajanje=TERMIN_TRAJANJE_MIN, dani=dani)
+    resp.cache_control.no_cache = True
+    return resp
+
+# ---- prijem zahtjeva: token bucket po IP-u i kontaktu + limit u letu ----
+# Samo za kontakt formu (/posalji_poruku); potvrdu termina otvara osoblje iz
+# mail-a sa IP-a ordinacije, pa ona nije pod ovim limitima.
+# Limit "N/S": do N zahtjeva odjednom, a bucket se puni N tokena za S sekundi.
+# "0" isključuje limit. RATE_BACKEND=sqlite drži stanje u bazi (dijeli se
+# između gunicorn workera na istom disku); "memory" je po procesu.
+# Preko limita odmah vraćamo 429 + Retry-After, ništa ne čeka u redu.
+def _parse_limit(s):
+    s = (s or "").strip()
+    if not s or s == "0":
+        return None
+    n, _, sek = s.partition("/")
+    n, sek = float(n), float(sek or 60)
+    return (n, n / sek) if n > 0 and sek > 0 else None
+
+RATE_IP = _parse_limit(os.environ.get("RATE_IP", "5/300"))
+RATE_KONTAKT = _parse_limit(os.environ.get("RATE_KONTAKT", "3/600"))
+RATE_BACKEND = (os.environ.get("RATE_BACKEND") or "memory").lower()
+U_LETU_MAX = int(os.environ.get("U_LETU_MAX", "8"))
+
+# Render (i svaki reverse proxy) stavlja pravu IP adresu u X-Forwarded-For;
+# bez ovoga bi svi klijenti dijelili IP proxy-ja.
+PROXY_HOPS = int(os.environ.get("PROXY_HOPS", "0"))
+if PROXY_HOPS > 0:
+    from werkzeug.middleware.proxy_fix import ProxyFix
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS)
+
+class TokenBucketi:
+    """Token bucket po ključu (u memoriji). uzmi() -> 0 ili sekunde do sljedećeg tokena."""
+    MAX_KLJUCEVA = 10000
+
+    def __init__(self, prefiks, kapacitet, po_sekundi):
+        self.prefiks = prefiks
+        self.kapacitet = kapacitet
+        self.po_sekundi = po_sekundi
+        self.lock = threading.Lock()
+        self.stanje = {}  # kljuc -> (tokeni, ts)
+
+    def _dopuni(self, tokeni, ts, sada):
+        return min(self.kapacitet, tokeni + (sada - ts) * self.po_sekundi)
+
+    def uzmi(self, kljuc):
+        sada = time.monotonic()
+        with self.lock:
+            tokeni, ts = self.stanje.get(kljuc, (self.kapacitet, sada))
+            tokeni = self._dopuni(tokeni, ts, sada)
+            if tokeni >= 1:
+                self.stanje[kljuc] = (tokeni - 1, sada)
+                if len(self.stanje) > self.MAX_KLJUCEVA:
+                    self._ocisti(sada)
+                return 0.0
+            self.stanje[kljuc] = (tokeni, sada)
+        return (1 - tokeni) / self.po_sekundi
+
+    def _ocisti(self, sada):
+        # bucket koji bi se do sada napunio ne nosi informaciju
+        pun = self.kapacitet / self.po_sekundi
+        self.stanje = {k: v for k, v in self.stanje.items() if sada - v[1] < pun}
+
+class SqliteTokenBucketi(TokenBucketi):
+    """Isto, ali stanje je u tabeli `limiter` (zajedničko za sve workere)."""
+    CISTI_SVAKIH = 500
+
+    def __init__(self, *a):
+        super().__init__(*a)
+        self.poziva = 0
+
+    def uzmi(self, kljuc):
+        sada = time.time()  # monotonic nije uporediv između procesa
+        kljuc = f"{self.prefiks}:{kljuc}"
+        with transakcija() as con:
+            r = con.execute("SELECT tokeni, ts FROM limiter WHERE kljuc = ?", (kljuc,)).fetchone()
+            tokeni = self.kapacitet if r is None else self._dopuni(r["tokeni"], r["ts"], sada)
+            cekaj = 0.0 if tokeni >= 1 else (1 - tokeni) / self.po_sekundi
+            if not cekaj:
+                tokeni -= 1
+            con.execute("INSERT OR REPLACE INTO limiter (kljuc, tokeni, ts) VALUES (?, ?, ?)", (kljuc, tokeni, sada))
+            self.poziva += 1
+            if self.poziva % self.CISTI_SVAKIH == 0:
+                con.execute("DELETE FROM limiter WHERE kljuc >= ? AND kljuc < ? AND ts < ?",
+                            (self.prefiks + ":", self.prefiks + ";", sada - self.kapacitet / self.po_sekundi))
+        return cekaj
+
+def _napravi_limit(prefiks, limit):
+    if limit is None:
+        return None
+    cls = SqliteTokenBucketi if RATE_BACKEND == "sqlite" else TokenBucketi
+    return cls(prefiks, *limit)
+
+limit_ip = _napravi_limit("ip", RATE_IP)
+limit_kontakt = _napravi_limit("kontakt", RATE_KONTAKT)
+u_letu = threading.BoundedSemaphore(U_LETU_MAX)
+ODBIJENO = {"ip": 0, "kontakt": 0, "u_letu": 0}
+
+def _odbij(razlog, cekaj, kao_json):
+    with _zahtjevi_lock:
+        ODBIJENO[razlog] += 1
+    poruka = ("Server je trenutno zauzet, pokušajte ponovo za par sekundi." if razlog == "u_letu"
+              else "Previše zahtjeva. Pokušajte ponovo malo kasnije.")
+    resp = jsonify(ok=False, error=poruka) if kao_json else Response(poruka, mimetype="text/plain")
+    resp.status_code = 429
+    resp.headers["Retry-After"] = str(max(1, math.ceil(cekaj)))
+    return resp
+
+def provjeri_limite(kontakt, kao_json=True):
     """
-    Vraća (tip, vrijednost):
-    - ("email", email) / ("phone", normalizovan_broj) / ("text", original)
+    None ako IP i kontakt imaju token, inače 429 odgovor. Poziva se tek poslije
+    validacije forme, da neispravan zahtjev (400) ne troši tokene.
     """
-    k = (k or "").strip()
-    if not k:
-        return ("text", "")
-    if is_email(k):
-        return ("email", k)
-    phone = normalize_phone(k)
-    if phone:
-        return ("phone", phone)
-    return ("text", k)
+    if limit_ip is not None:
+        cekaj = limit_ip.uzmi(request.remote_addr or "")
+        if cekaj:
+            return _odbij("ip", cekaj, kao_json)
+    if limit_kontakt is None or not kontakt:
+        return None
+    cekaj = limit_kontakt.uzmi(kontakt.lower())
+    return _odbij("kontakt", cekaj, kao_json) if cekaj else None
+
+def ogranicen_prijem(kao_json=True):
+    """Dekorator za POST rute koje pišu u bazu i šalju mail: limit u letu (tokene troši provjeri_limite)."""
+    def dekorator(f):
+        @functools.wraps(f)
+        def omot(*a, **kw):
+            if request.method != "POST":
+                return f(*a, **kw)
+            if not u_letu.acquire(blocking=False):
+                return _odbij("u_letu", 1, kao_json)
+            try:
+                return f(*a, **kw)
+            finally:
+                u_letu.release()
+        return omot
+    return dekorator
+
+# ---- idempotentnost: isti sadržaj u kratkom prozoru = isti odgovor ----
+# Dupli klik ili ponovljen mobilni zahtjev daje isti heš sadržaja; vraćamo
+# sačuvan odgovor originala bez novog upisa u bazu/CSV i novog maila. Ako je
+# original još u obradi, duplikat sačeka njegov rezultat.
+IDEMPOTENT_TTL_S = float(os.environ.get("IDEMPOTENT_TTL_S", "120"))
+IDEMPOTENT_MAX = 5000
+IDEMPOTENT_CEKAJ_S = 15
+
+class _IdemUnos:
+    __slots__ = ("istice", "odgovor", "gotovo")
+
+    def __init__(self, istice):
+        self.istice = istice
+        self.odgovor = None  # (status, body, content_type) kad original uspije
+        self.gotovo = threading.Event()
+
+class IdempotentniKes:
+    def __init__(self, ttl, maks):
+        self.ttl = ttl
+        self.maks = maks
+        self.lock = threading.Lock()
+        self.unosi = {}  # kljuc -> _IdemUnos, redom umetanja (= redom isteka)
+        self.ponovljeno = 0
+
+    def _ocisti(self, sada):
+        while self.unosi:
+            kljuc = next(iter(self.unosi))
+            if self.unosi[kljuc].istice > sada and len(self.unosi) <= self.maks:
+                break
+            del self.unosi[kljuc]
+
+    def izvrsi(self, kljuc, fn):
+        sada = time.monotonic()
+        with self.lock:
+            self._ocisti(sada)
+            u = self.unosi.get(kljuc)
+            vlasnik = u is None
+            if vlasnik:
+                u = self.unosi[kljuc] = _IdemUnos(sada + self.ttl)
+        if not vlasnik:
+            u.gotovo.wait(IDEMPOTENT_CEKAJ_S)
+            if u.odgovor is None:
+                return fn()  # original nije uspio (ili još traje) -> radimo sami
+            with self.lock:
+                self.ponovljeno += 1
+            status, body, tip = u.odgovor
+            return Response(body, status=status, content_type=tip, headers={"Idempotent-Replay": "true"})
+        try:
+            resp = app.make_response(fn())
+            if 200 <= resp.status_code < 300 and not resp.is_streamed:
+                u.odgovor = (resp.status_code, resp.get_data(), resp.headers.get("Content-Type"))
+            return resp
+        finally:
+            if u.odgovor is None:
+                with self.lock:
+                    if self.unosi.get(kljuc) is u:
+                        del self.unosi[kljuc]
+            u.gotovo.set()
+
+idempotentni_kes = IdempotentniKes(IDEMPOTENT_TTL_S, IDEMPOTENT_MAX)
+
+def idempotentno(dijelovi_fn):
+    """
+    Dekorator za POST: dijelovi_fn() vraća polja koja određuju "isti zahtjev"
+    (ili None = bez deduplikacije). Stoji iznad ogranicen_prijem, pa duplikati
+    ne troše tokene limita ni mjesto u letu.
+    """
+    def dekorator(f):
+        @functools.wraps(f)
+        def omot(*a, **kw):
+            if request.method != "POST" or IDEMPOTENT_TTL_S <= 0:
+                return f(*a, **kw)
+            dijelovi = dijelovi_fn()
+            if dijelovi is None:
+                return f(*a, **kw)
+            kljuc = hashlib.sha256("\x1f".join((request.endpoint or "",) + tuple(dijelovi)).encode("utf-8")).hexdigest()
+            return idempotentni_kes.izvrsi(kljuc, lambda: f(*a, **kw))
+        return omot
+    return dekorator
+
+def _idem_poruka():
+    data = request.get_json(force=True, silent=True) or {}
+    poruka = (data.get("poruka") or "").strip()
+    if not poruka:
+        return None
+    kontakt = classify_kontakt((data.get("kontakt") or "").strip())[1].lower()
+    # bez kontakta je jedini identitet IP (dva anonimna "Zdravo" nisu duplikat)
+    return ((data.get("ime") or "").strip(), kontakt or "ip:" + (request.remote_addr or ""), poruka)
 
-def build_mailto(to_email: str, subject: str, body: str) -> str:
-    qs = {"subject": subject, "body": body}
-    return f"mailto:{to_email}?{urllib.parse.urlencode(qs)}"
+def _idem_termin():
+    dt = (request.form.get("dt") or "").strip()
+    if not dt:
+        return None
+    email = (request.form.get("email") or "").strip().lower()
+    telefon = (request.form.get("telefon") or "").strip()
+    return ((request.form.get("ime") or "").strip(), email, normalize_phone(telefon) or telefon, dt)
+
+# ---- statički fajlovi: manifest sa hešom sadržaja (/a/...) ----
+# Gradi se jednom pri pokretanju (pod --preload u master procesu): svaki fajl
+# iz static/ dobija ime.<sha256[:12]>.ext i čuva se u memoriji, zajedno sa
+# gzip/brotli varijantom samo ako je ona bar 10% manja (PNG je već
+# kompresovan pa ostaje kako jeste). URL se mijenja sa sadržajem, pa
+# Cache-Control može biti immutable – ponovna posjeta ne revalidira ništa.
+ASSET_MAX_AGE = 365 * 24 * 3600
+ASSET_USTEDA_MIN = 0.9
+
+class AssetManifest:
+    def __init__(self, folder):
+        self.folder = folder
+        self.imena = {}    # "open.png" -> "open.3f2a9c0d1e4b.png"
+        self.fajlovi = {}  # heširano ime -> (podaci, mimetype, heš, {kodiranje: podaci})
+        if os.path.isdir(folder):
+            self._izgradi()
+
+    @staticmethod
+    def _varijante(podaci):
+        out = {}
+        z = zlib.compressobj(9, zlib.DEFLATED, 31)  # wbits=31 -> gzip
+        gz = z.compress(podaci) + z.flush()
+        if len(gz) <= len(podaci) * ASSET_USTEDA_MIN:
+            out["gzip"] = gz
+        if brotli is not None:
+            br = brotli.compress(podaci)
+            if len(br) <= len(podaci) * ASSET_USTEDA_MIN:
+                out["br"] = br
+        return out
+
+    def _izgradi(self):
+        for koren, dirs, fajlovi in os.walk(self.folder):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for f in fajlovi:
+                if f.startswith("."):
+                    continue
+                path = os.path.join(koren, f)
+                ime = os.path.relpath(path, self.folder).replace(os.sep, "/")
+                with open(path, "rb") as fh:
+                    podaci = fh.read()
+                h = hashlib.sha256(podaci).hexdigest()[:12]
+                osnova, ext = os.path.splitext(ime)
+                hesirano = f"{osnova}.{h}{ext}"
+                tip = mimetypes.guess_type(ime)[0] or "application/octet-stream"
+                self.imena[ime] = hesirano
+                self.fajlovi[hesirano] = (podaci, tip, h, self._varijante(podaci))
+
+    def url(self, ime):
+        hesirano = self.imena.get(ime)
+        if hesirano is None:
+            return url_for("static", filename=ime)  # fajl dodat poslije starta
+        return url_for("asset", ime=hesirano)
+
+    def pregled(self):
+        return {
+            ime: {"url": h, "bajta": len(self.fajlovi[h][0]),
+                  **{k: len(v) for k, v in self.fajlovi[h][3].items()}}
+            for ime, h in sorted(self.imena.items())
+        }
+
+assets = AssetManifest(app.static_folder)
+app.jinja_env.globals["asset_url"] = assets.url
+
+@app.get("/a/<path:ime>")
+def asset(ime):
+    f = assets.fajlovi.get(ime)
+    if f is None:
+        abort(404)
+    podaci, tip, h, varijante = f
+    kodiranje = next((k for k in ("br", "gzip") if k in varijante and request.accept_encodings[k]), None)
+    resp = Response(varijante[kodiranje] if kodiranje else podaci, mimetype=tip)
+    if kodiranje:
+        resp.headers["Content-Encoding"] = kodiranje
+    if varijante:
+        resp.vary.add("Accept-Encoding")
+    resp.set_etag(f"{h}-{kodiranje}" if kodiranje else h)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = ASSET_MAX_AGE
+    resp.cache_control.immutable = True
+    return resp.make_conditional(request)
+
+# ---- keš naslovne strane ----
+# index.html zavisi samo od stanja (status_kljuc) i rasporeda, pa dnevno
+# postoji svega par različitih verzija. Gotovi bajtovi + ETag čuvaju se po
+# status_kljuc do sljedećeg prelaza; izmjena data.json / pravila.json mijenja
+# raspored_verzija i briše sve unose. Pogodak je lookup u dict-u, a
+# If-None-Match sa istim ETag-om -> 304 bez tijela.
+class KesStranice:
+    def __init__(self, max_unosa=16):
+        self.lock = threading.Lock()
+        self.max_unosa = max_unosa
+        self.verzija = None
+        self.unosi = {}  # status_kljuc -> (tijelo, etag, istice)
+        self.stats = {"pogoci": 0, "promasaji": 0, "304": 0}
+
+    def uzmi(self, verzija, kljuc, sada):
+        unos = self.unosi.get(kljuc) if verzija == self.verzija else None
+        if unos is None or (unos[2] is not None and sada >= unos[2]):
+            return None
+        return unos
+
+    def stavi(self, verzija, kljuc, tijelo, istice):
+        unos = (tijelo, hashlib.blake2b(tijelo, digest_size=12).hexdigest(), istice)
+        with self.lock:
+            if verzija != self.verzija:
+                self.unosi = {}
+                self.verzija = verzija
+            if len(self.unosi) >= self.max_unosa:
+                self.unosi.clear()
+            self.unosi[kljuc] = unos
+        return unos
+
+kes_naslovne = KesStranice()
 
 @app.route("/")
 def index():
     sada = now_podgorica()
-    dan = sada.weekday()  # 0=pon, 6=ned
-    ime_dana = DANI_PUNIM[dan].lower()
-
-    # default prema danu u nedelji
-    sv = RADNO_VRIJEME.get(ime_dana)
-    if sv is None:
-        start, end = None, None
-    else:
-        start, end = sv["start"], sv["end"]
-
-    # prepiši ako u data.json postoji unos za današnji datum
-    posebni = ucitaj_posebne_datume()
-    datum_str = sada.strftime("%Y-%m-%d")
-    ps = posebni.get(datum_str)
-
-    if isinstance(ps, (list, tuple)) and len(ps) == 2:
-        start = ps[0] if ps[0] is not None else None
-        end   = ps[1] if ps[1] is not None else None
 
-    # provjera u minutama (robustno na float)
-    start_m = to_minutes(start) if start is not None else None
-    end_m   = to_minutes(end)   if end   is not None else None
-
-    if start_m is None or end_m is None:
-        poruka_html = "Danas je neradni dan."
-        poruka_tts  = "Danas je neradni dan."
-        status_slika = "close1.png"
+    # verzija prije stanja: ako se raspored promijeni između, unos ide pod
+    # staru verziju i odbacuje se već na sljedećem zahtjevu
+    verzija = raspored_verzija()
+    st = vremenska_linija.status(sada)
+    kljuc = status_kljuc(st)
+
+    unos = kes_naslovne.uzmi(verzija, kljuc, sada)
+    if unos is None:
+        kes_naslovne.stats["promasaji"] += 1
+        poruka_html, poruka_tts, status_slika = status_poruka(st)
+        tijelo = render_template(
+            "index.html",
+            poruka_upper=poruka_html.upper(),
+            poruka=poruka_html,
+            poruka_tts=poruka_tts,
+            status_slika=status_slika,
+            status_kljuc=kljuc,
+        ).encode("utf-8")
+        unos = kes_naslovne.stavi(verzija, kljuc, tijelo, st["sljedeca_promjena"])
     else:
-        now_m = sada.hour * 60 + sada.minute
-        otvoreno_sad = (start_m <= now_m < end_m)
-        if otvoreno_sad:
-            linije = [
-                "Ordinacija je trenutno otvorena.",
-                f"Danas je radno vrijeme od {sat_label(start)} do {sat_label(end)} časova."
-            ]
-            status_slika = "open.png"
-        else:
-            linije = [
-                "Ordinacija je trenutno zatvorena.",
-                f"Danas je radno vrijeme od {sat_label(start)} do {sat_label(end)} časova."
-            ]
-            status_slika = "close1.png"
-
-        poruka_html = "<br>".join(linije)
-        poruka_tts  = " ".join(linije)
-
-    poruka_upper = poruka_html.upper()
+        kes_naslovne.stats["pogoci"] += 1
 
-    return render_template(
-        "index.html",
-        poruka_upper=poruka_upper,
-        poruka=poruka_html,
-        poruka_tts=poruka_tts,
-        status_slika=status_slika
-    )
+    resp = Response(unos[0], mimetype="text/html")
+    resp.set_etag(unos[1])
+    resp.cache_control.no_cache = True  # pregledač uvijek pita; odgovor je 304 dok se stanje ne promijeni
+    resp = resp.make_conditional(request)
+    if resp.status_code == 304:
+        kes_naslovne.stats["304"] += 1
+    return resp
 
 @app.route("/admin", methods=["GET", "POST"])
 def admin():
-    posebni = ucitaj_posebne_datume()
-
     if request.method == "POST":
         datum = (request.form.get("datum") or "").strip()
         if not datum:
             return redirect(url_for("admin"))
+        # ključ mora biti YYYY-MM-DD, kao i u API-ju (inače ga pretraga po danu ne nalazi)
+        datum = _normalizuj_datum(datum)
+        if datum is None:
+            return redirect(url_for("admin", greska="Neispravan datum (očekuje se YYYY-MM-DD)."))
 
         if "neradni" in request.form:
             start = end = None
@@ -302,22 +2664,299 @@ def admin():
             if start is None or end is None:
                 start = end = None
 
-        posebni[datum] = [start, end]
-        sacuvaj_posebne_datume(posebni)
+        with izmjena_posebnih_datuma() as posebni:
+            posebni[datum] = [start, end]
         return redirect(url_for("admin"))
 
-    sortirano = dict(sorted(posebni.items()))
-    return render_template("admin.html", posebni=sortirano)
+    return render_template(
+        "admin.html",
+        posebni=posebni_sortirano(),
+        pravila=ucitaj_pravila(),
+        naredni_dani=naredni_dani(14),
+        greska=request.args.get("greska", ""),
+    )
+
+_sortirano_kes = {"verzija": None, "data": {}}
+
+def posebni_sortirano():
+    """Sortiran pogled na data.json; sortira se samo kad se fajl promijeni."""
+    v = posebni_kes.osvjezi()
+    if _sortirano_kes["verzija"] != v:
+        _sortirano_kes["data"] = dict(sorted(posebni_kes.trenutno().items()))
+        _sortirano_kes["verzija"] = v
+    return _sortirano_kes["data"]
+
+def naredni_dani(n):
+    """Efektivno radno vrijeme narednih n dana i njegov izvor (za admin pregled)."""
+    danas = now_podgorica().date()
+    posebni = posebni_kes.trenutno()
+    out = []
+    for i in range(n):
+        d = danas + timedelta(days=i)
+        start, end = radno_vrijeme_za_datum(d, posebni)
+        if d.strftime("%Y-%m-%d") in posebni:
+            izvor = "poseban datum"
+        else:
+            pr = pravila_raspored.za_datum(d)
+            izvor = f"pravilo: {pr[1] or 'bez naziva'}" if pr is not None else "redovno"
+        out.append({"datum": d.strftime("%Y-%m-%d"), "dan": DANI_PUNIM[d.weekday()], "start": start, "end": end, "izvor": izvor})
+    return out
+
+@app.post("/admin/pravila")
+def admin_pravila():
+    pravilo, greska = pravilo_iz_forme(request.form)
+    if greska:
+        return redirect(url_for("admin", greska=greska))
+    with izmjena_pravila() as pravila:
+        pravila.append(pravilo)
+    return redirect(url_for("admin"))
+
+@app.route("/admin/pravila/obrisi/<pravilo_id>")
+def admin_pravila_obrisi(pravilo_id):
+    with izmjena_pravila() as pravila:
+        pravila[:] = [p for p in pravila if p.get("id") != pravilo_id]
+    return redirect(url_for("admin"))
+
+@app.get("/admin/kes")
+def admin_kes():
+    return jsonify(posebni=posebni_kes.stats(), assets=assets.pregled(), naslovna=kes_naslovne.stats)
+
+# ---- admin pristup ličnim podacima pacijenata ----
+# Poruke, izvoz i mail red sadrže imena, kontakte, IP i tekst poruka. Bez
+# ADMIN_TOKEN te rute ne postoje (404); sa njim traže HTTP Basic auth (bilo
+# koje korisničko ime, token kao lozinka), pa pregledač sam nosi pristup kroz
+# paginaciju i linkove za izvoz.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+def admin_token_potreban(f):
+    @functools.wraps(f)
+    def omot(*a, **kw):
+        if not ADMIN_TOKEN:
+            abort(404)
+        auth = request.authorization
+        lozinka = (auth.password if auth is not None else None) or ""
+        if not hmac.compare_digest(lozinka.encode(), ADMIN_TOKEN.encode()):
+            return Response("Potrebna je prijava.", 401,
+                            {"WWW-Authenticate": 'Basic realm="DENTALAB admin", charset="UTF-8"'})
+        return f(*a, **kw)
+    return omot
+
+# ---- admin: pregled poruka + izvoz ----
+PORUKE_PO_STRANI = 50
+
+def _dan_u_epoch(s, plus_dana=0):
+    """'YYYY-MM-DD' (lokalno, Europe/Podgorica) -> epoch sekunde ponoći."""
+    try:
+        d = datetime.strptime(s, "%Y-%m-%d") + timedelta(days=plus_dana)
+    except (ValueError, TypeError):
+        return None
+    return int(d.replace(tzinfo=TZ).timestamp())
+
+def _filter_poruka(args):
+    """od/do (uključivo, po danima) i kontakt (prefiks) -> (WHERE sql, parametri)."""
+    uslovi, params = [], []
+    od = _dan_u_epoch(args.get("od"))
+    do = _dan_u_epoch(args.get("do"), plus_dana=1)
+    kontakt = (args.get("kontakt") or "").strip()
+    if od is not None:
+        uslovi.append("ts_utc >= ?")
+        params.append(od)
+    if do is not None:
+        uslovi.append("ts_utc < ?")
+        params.append(do)
+    if kontakt:
+        # opseg umjesto LIKE -> koristi indeks poruke_kontakt
+        uslovi.append("kontakt >= ? AND kontakt < ?")
+        params += [kontakt, kontakt + "\U0010ffff"]
+    return uslovi, params
+
+@app.get("/admin/poruke")
+@admin_token_potreban
+def admin_poruke():
+    uslovi, params = _filter_poruka(request.args)
+    n = min(max(to_int_or_none(request.args.get("n")) or PORUKE_PO_STRANI, 1), 500)
+
+    # keyset paginacija: kursor je (ts_utc, id) zadnjeg reda prethodne strane
+    prije = (request.args.get("prije") or "").split(":")
+    if len(prije) == 2 and all(p.isdigit() for p in prije):
+        uslovi.append("(ts_utc, id) < (?, ?)")
+        params += [int(prije[0]), int(prije[1])]
+
+    where = ("WHERE " + " AND ".join(uslovi)) if uslovi else ""
+    redovi = db().execute(
+        f"SELECT id, ts, ts_utc, ime, kontakt, ip, poruka FROM poruke {where} "
+        "ORDER BY ts_utc DESC, id DESC LIMIT ?",
+        params + [n + 1],
+    ).fetchall()
+
+    sljedeca = None
+    if len(redovi) > n:
+        redovi = redovi[:n]
+        zadnji = redovi[-1]
+        sljedeca = f"{zadnji['ts_utc']}:{zadnji['id']}"
+
+    # "pacijent se vraća": po jedan indeksiran upit za svaki red sa email/telefonom
+    istorije = {r["id"]: opis_istorije(istorija_kontakta(kanon_kontakta(r["kontakt"]), r["ts_utc"], r["id"]))
+                for r in redovi if r["kontakt"]}
+
+    filteri = {k: request.args.get(k, "") for k in ("od", "do", "kontakt")}
+    return render_template("poruke.html", poruke=redovi, sljedeca=sljedeca, filteri=filteri, n=n,
+                           istorije=istorije)
+
+@app.get("/admin/poruke/export")
+@admin_token_potreban
+def admin_poruke_export():
+    """
+    Streaming izvoz (CSV ili NDJSON, opciono gzip). Redovi se čitaju u
+    paketima kroz kursor i odmah šalju -> memorija ne raste sa veličinom baze.
+    """
+    fmt = request.args.get("format", "csv")
+    if fmt not in ("csv", "ndjson"):
+        return "Nepoznat format (csv ili ndjson).", 400
+    gz = request.args.get("gzip") in ("1", "true", "da")
+    uslovi, params = _filter_poruka(request.args)
+    where = ("WHERE " + " AND ".join(uslovi)) if uslovi else ""
+    sql = f"SELECT ts, ime, kontakt, ip, poruka FROM poruke {where} ORDER BY ts_utc, id"
+
+    def redovi():
+        # posebna konekcija: dug kursor ne smije dijeliti konekciju niti
+        con = sqlite3.connect(DB_PATH, timeout=10)
+        try:
+            cur = con.execute(sql, params)
+            if fmt == "csv":
+                buf = io.StringIO()
+                w = csv.writer(buf)
+                w.writerow(CSV_HEADER)
+                while True:
+                    paket = cur.fetchmany(500)
+                    if not paket:
+                        break
+                    w.writerows(paket)
+                    yield buf.getvalue().encode("utf-8")
+                    buf.seek(0)
+                    buf.truncate()
+                if buf.tell():
+                    yield buf.getvalue().encode("utf-8")
+            else:
+                while True:
+                    paket = cur.fetchmany(500)
+                    if not paket:
+                        break
+                    yield "".join(
+                        json.dumps(dict(zip(CSV_HEADER, r)), ensure_ascii=False) + "\n" for r in paket
+                    ).encode("utf-8")
+        finally:
+            con.close()
+
+    def gzipovano(chunks):
+        z = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip header
+        for c in chunks:
+            out = z.compress(c)
+            if out:
+                yield out
+        yield z.flush()
+
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    ime_fajla = f"poruke.{fmt}" + (".gz" if gz else "")
+    body = gzipovano(redovi()) if gz else redovi()
+    return Response(
+        body,
+        mimetype="application/gzip" if gz else mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{ime_fajla}"'},
+    )
+
+@app.get("/admin/mail")
+@admin_token_potreban
+def admin_mail():
+    pregled = mail_red_pregled()
+    if request.args.get("format") == "json":
+        return jsonify(stats=MAIL_STATS, smtp=smtp_pool.pregled(), digest=_broj_u_spoolu("digest"), **pregled)
+    return render_template("mail_red.html", stats=MAIL_STATS, smtp=smtp_pool.pregled(),
+                           digest=_broj_u_spoolu("digest") if MAIL_DIGEST else None, **pregled)
+
+@app.post("/admin/mail/ponovi/<mail_id>")
+@admin_token_potreban
+def admin_mail_ponovi(mail_id):
+    # vrati neuspjelu poruku u red, sa resetovanim brojačem pokušaja
+    # (POST: prefetch linkova i crawleri ne smiju mijenjati spool)
+    src = os.path.join(_spool_dir("failed"), os.path.basename(mail_id) + ".json")
+    try:
+        with open(src, "r", encoding="utf-8") as f:
+            zapis = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return redirect(url_for("admin_mail"))
+    zapis.update(pokusaja=0, sljedeci=0)
+    _upisi_atomicno(os.path.join(_spool_dir("pending"), os.path.basename(src)), zapis)
+    os.remove(src)
+    mail_budjenje.set()
+    return redirect(url_for("admin_mail"))
+
+# ---- admin API: grupne izmjene data.json ----
+def _sati_ispravni(v):
+    if v is None:
+        return True
+    if not isinstance(v, (list, tuple)) or len(v) != 2:
+        return False
+    if v[0] is None and v[1] is None:
+        return True
+    return all(isinstance(x, (int, float)) and not isinstance(x, bool) and 0 <= x <= 24 for x in v) and v[0] < v[1]
+
+@app.route("/admin/api/posebni", methods=["GET", "POST"])
+def admin_api_posebni():
+    """
+    GET  -> trenutni data.json
+    POST -> {"upsert": {"YYYY-MM-DD": [start, end] | [null, null]}, "obrisi": ["YYYY-MM-DD", ...]}
+    Sve izmjene idu u jednoj transakciji: jedno čitanje i jedan atomski upis
+    pod zaključavanjem, ili ništa ako je bilo koji unos neispravan.
+    """
+    if request.method == "GET":
+        return jsonify(posebni_sortirano())
+
+    body = request.get_json(force=True, silent=True)
+    if not isinstance(body, dict):
+        return jsonify(ok=False, error="Očekuje se JSON objekat."), 400
+    upsert = body.get("upsert") or {}
+    obrisi_lista = body.get("obrisi") or []
+    if not isinstance(upsert, dict) or not isinstance(obrisi_lista, list):
+        return jsonify(ok=False, error="upsert mora biti objekat, obrisi lista."), 400
+
+    greske = []
+    for datum in list(upsert) + obrisi_lista:
+        if _normalizuj_datum(datum) is None:
+            greske.append(f"Neispravan datum: {datum}")
+    for datum, sati in upsert.items():
+        if not _sati_ispravni(sati):
+            greske.append(f"Neispravni sati za {datum}: {sati}")
+    if greske:
+        return jsonify(ok=False, errors=greske), 400
+    # ključevi u data.json su uvijek YYYY-MM-DD ("2027-1-5" -> "2027-01-05"),
+    # kao što ih traži radno_vrijeme_za_datum
+    upsert = {_normalizuj_datum(d): sati for d, sati in upsert.items()}
+    obrisi_lista = [_normalizuj_datum(d) for d in obrisi_lista]
+
+    try:
+        with izmjena_posebnih_datuma() as posebni:
+            for datum in obrisi_lista:
+                posebni.pop(datum, None)
+            for datum, sati in upsert.items():
+                posebni[datum] = list(sati) if sati is not None else [None, None]
+            ukupno = len(posebni)
+    except ValueError as e:
+        return jsonify(ok=False, error=str(e)), 409
+
+    return jsonify(ok=True, upsertovano=len(upsert), obrisano=len(obrisi_lista), ukupno=ukupno)
 
 @app.route("/obrisi/<datum>")
 def obrisi(datum):
-    posebni = ucitaj_posebne_datume()
-    if datum in posebni:
-        del posebni[datum]
-        sacuvaj_posebne_datume(posebni)
+    datum = _normalizuj_datum(datum)
+    if datum in ucitaj_posebne_datume():
+        with izmjena_posebnih_datuma() as posebni:
+            posebni.pop(datum, None)
     return redirect(url_for("admin"))
 
 @app.route("/posalji_poruku", methods=["POST"])
+@idempotentno(_idem_poruka)
+@ogranicen_prijem()
 def posalji_poruku():
     data = request.get_json(force=True, silent=True) or {}
     ime     = (data.get("ime") or "").strip()
@@ -329,123 +2968,57 @@ def posalji_poruku():
 
     now = now_podgorica()
     kontakt_tip, kontakt_val = classify_kontakt(kontakt)
+    odbij = provjeri_limite(kontakt_val)
+    if odbij is not None:
+        return odbij
 
-    # linije za plain text i HTML link za kontakt
-    if kontakt_tip == "email":
-        kontakt_linija_txt = f"E-mail: {kontakt_val}"
-        kontakt_link_html  = f'<a href="mailto:{html.escape(kontakt_val)}" style="color:#2563eb;text-decoration:none;">{html.escape(kontakt_val)}</a>'
-    elif kontakt_tip == "phone":
-        tel_uri = "tel:" + re.sub(r"[^\d+]", "", kontakt_val)
-        kontakt_linija_txt = f"Telefon: {kontakt_val}"
-        kontakt_link_html  = f'<a href="{html.escape(tel_uri)}" style="color:#2563eb;text-decoration:none;">{html.escape(kontakt_val)}</a>'
-    else:
-        kontakt_linija_txt = f"Kontakt: {kontakt_val or '—'}"
-        kontakt_link_html  = html.escape(kontakt_val or "—")
-
-    body_txt = (
-        f"Ime i prezime: {ime or '—'}\n"
-        f"{kontakt_linija_txt}\n\n"
-        f"Poruka:\n{poruka}\n\n"
-        f"Vrijeme: {now.isoformat()}\n"
-        f"IP: {request.remote_addr or ''}\n"
-    )
-
-    # link za prefill potvrde termina
-    url_base = request.url_root.rstrip("/")
-    confirm_qs = urllib.parse.urlencode({
-        "ime": ime or "",
-        "email": kontakt_val if (kontakt_tip == "email") else "",
-        "telefon": kontakt_val if (kontakt_tip == "phone") else "",
-        "ref": f"Ref: poruka sa sajta {now.strftime('%d.%m.%Y %H:%M')}",
-    })
-    confirm_url = f"{url_base}/potvrdi_termin?{confirm_qs}"
-    confirm_btn_html = (
-        f'<a href="{html.escape(confirm_url)}" '
-        'style="display:inline-block;background:#111827;color:#fff;'
-        'padding:12px 18px;border-radius:8px;text-decoration:none;font-weight:700;">'
-        'Potvrdi termin</a>'
-    )
-
-    # brzi odgovori
-    mail_to = "dentalabplaner@gmail.com"
-    quick_reply_to = kontakt_val if (kontakt_tip == "email" and kontakt_val) else mail_to
-
-    def build_mailto(to_email: str, subject: str, body: str) -> str:
-        qs = {"subject": subject, "body": body}
-        return f"mailto:{to_email}?{urllib.parse.urlencode(qs)}"
-
-    hvala_link = build_mailto(
-        quick_reply_to,
-        f"Hvala na poruci – {ime or 'poštovani/na'}",
-        "Hvala Vam na javljanju. Uskoro ćemo se povratno javiti.\n\n— DENTALAB",
-    )
-    prosledjujem_link = build_mailto(
-        quick_reply_to,
-        f"Vaša poruka je prosleđena – {ime or 'poštovani/na'}",
-        "Vašu poruku smo prosledili nadležnom timu/doktoru. Javićemo Vam se čim dobijemo povratnu informaciju.\n\n— DENTALAB",
-    )
+    # istorija iz indeksa kontakata (prije upisa ove poruke)
+    try:
+        istorija = opis_istorije(istorija_kontakta(kanon_kontakta(kontakt), int(now.timestamp())))
+    except sqlite3.Error as e:
+        print(f"Contact history error: {e}", flush=True)
+        istorija = ""
+
+    podaci = {
+        "ime": ime, "kontakt": kontakt, "poruka": poruka, "ts": now.isoformat(),
+        "ip": request.remote_addr or "", "url_base": request.url_root.rstrip("/"),
+        "istorija": istorija,
+    }
+
+    # zapis u bazu
+    try:
+        sacuvaj_poruku(now.isoformat(), ime, kontakt, request.remote_addr or "", poruka)
+    except Exception as e:
+        print(f"DB write error: {e}", flush=True)
 
-    body_html = f"""
-    <html><body style="font-family:Arial,Helvetica,sans-serif; font-size:14px; color:#111;">
-      <p><b>Ime i prezime:</b> {html.escape(ime or '—')}</p>
-      <p><b>Kontakt:</b> {kontakt_link_html}</p>
-      <p><b>Poruka:</b><br>{html.escape(poruka).replace('\\n','<br>')}</p>
-      <hr style="border:none;border-top:1px solid #ddd;margin:12px 0">
-      <p style="color:#555;">
-        Vrijeme: {html.escape(now.isoformat())}<br>
-        IP: {html.escape(request.remote_addr or '')}
-      </p>
-      <div style="margin:20px 0;text-align:center;">
-        {confirm_btn_html}
-      </div>
-      <p style="margin-top:20px;color:#555;">Brzi odgovori:</p>
-      <ul style="list-style:none;padding:0;margin:0;">
-        <li style="margin:6px 0;"><a href="{html.escape(hvala_link)}" style="color:#2563eb;text-decoration:none;">Hvala</a></li>
-        <li style="margin:6px 0;"><a href="{html.escape(prosledjujem_link)}" style="color:#2563eb;text-decoration:none;">Prosleđujem</a></li>
-      </ul>
-    </body></html>
-    """
-
-    # CSV zapis
+    # CSV zapis (dnevnik)
     try:
-        newfile = not os.path.exists(CSV_PATH)
-        with open(CSV_PATH, "a", newline="", encoding="utf-8") as f:
-            w = csv.writer(f)
-            if newfile:
-                w.writerow(["datetime", "ime", "kontakt", "ip", "poruka"])
-            w.writerow([now.isoformat(), ime, kontakt, request.remote_addr or "", poruka])
+        csv_pisac.upisi([now.isoformat(), ime, kontakt, request.remote_addr or "", poruka])
     except Exception as e:
         print(f"CSV write error: {e}", flush=True)
 
-    # Slanje e-maila
-    user = os.environ.get("GMAIL_USER")
-    app_pw = (os.environ.get("GMAIL_APP_PASSWORD") or "").replace(" ", "")
+    # Slanje e-maila (preko spool-a ili digesta; radnik šalje u pozadini)
+    user, app_pw = gmail_kredencijali()
     if not user or not app_pw:
         return jsonify(ok=True, warning="Mail nije poslat (GMAIL_USER/GMAIL_APP_PASSWORD nisu postavljeni)."), 200
 
     try:
-        msg = EmailMessage()
-        msg["From"] = formataddr(("PORUKA SA SAJTA", user))
-        msg["To"] = "dentalabplaner@gmail.com"
-        msg["Subject"] = f"[Kontakt sa sajta] {ime or 'Anonimno'} — {now.strftime('%d.%m.%Y %H:%M')}"
-        msg.set_content(body_txt)
-        msg.add_alternative(body_html, subtype="html")
-
-        if kontakt_tip == "email" and kontakt_val:
-            msg["Reply-To"] = kontakt_val
-        if kontakt_tip == "phone" and kontakt_val:
-            msg["X-Contact-Phone"] = kontakt_val
-
-        context = ssl.create_default_context()
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465, context=context) as smtp:
-            smtp.login(user, app_pw)
-            smtp.send_message(msg)
+        if MAIL_DIGEST:
+            dodaj_u_digest(podaci)
+        else:
+            stavi_u_red(mail_za_poruku(kontakt_stavka(**podaci), user), opis="kontakt")
     except Exception as e:
-        print(f"Mail error: {e}", flush=True)
+        print(f"Mail queue error: {e}", flush=True)
         return jsonify(ok=True, warning=f"CSV sačuvan, ali slanje maila nije uspjelo: {type(e).__name__}"), 200
 
     return jsonify(ok=True), 200
+@functools.lru_cache(maxsize=None)
+def potvrdi_stranica():
+    return PredrenderovanSablon(app.jinja_env, "potvrdi_termin.html", ("ime", "email", "telefon", "ref"),
+                                korak=SLOT_KORAK_MIN)
+
 @app.route("/potvrdi_termin", methods=["GET", "POST"])
+@idempotentno(_idem_termin)
 def potvrdi_termin():
     # GET: forma sa flatpickr
     if request.method == "GET":
@@ -454,66 +3027,7 @@ def potvrdi_termin():
         telefon = (request.args.get("telefon") or "").strip()
         ref = (request.args.get("ref") or "").strip()
 
-        html_form = f"""<!DOCTYPE html>
-<html lang="sr">
-<head>
-<meta charset="utf-8" />
-<meta name="viewport" content="width=device-width,initial-scale=1" />
-<title>Potvrda termina</title>
-<link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/flatpickr/dist/flatpickr.min.css">
-<style>
-body {{ font-family: system-ui, Arial, sans-serif; background:#f9fafb; color:#111; margin:0; padding:24px; }}
-.card {{ max-width:520px; margin:0 auto; background:#fff; border:1px solid #e5e7eb; border-radius:12px; padding:18px; box-shadow:0 6px 18px rgba(0,0,0,.06); }}
-h1 {{ font-size:20px; margin:0 0 12px; }}
-.row {{ margin-bottom:10px; }}
-.input {{ width:100%; padding:12px; border:1px solid #d1d5db; border-radius:10px; }}
-.btn {{ display:inline-block; margin-top:8px; padding:12px 18px; border-radius:10px; border:1px solid #d1d5db; background:#111827; color:#fff; font-weight:700; cursor:pointer; }}
-.muted {{ color:#6b7280; font-size:12px; }}
-</style>
-</head>
-<body>
-<div class="card">
-<h1>Potvrda termina</h1>
-<form method="POST">
-  <div class="row">
-    <label>Ime i prezime</label>
-    <input class="input" name="ime" value="{html.escape(ime)}" />
-  </div>
-  <div class="row">
-    <label>E-pošta (opciono)</label>
-    <input class="input" name="email" value="{html.escape(email)}" />
-  </div>
-  <div class="row">
-    <label>Telefon (opciono)</label>
-    <input class="input" name="telefon" value="{html.escape(telefon)}" />
-  </div>
-  <div class="row">
-    <label>Datum i vrijeme</label>
-    <input id="dt" class="input" name="dt" required />
-  </div>
-  <div class="row">
-    <label>Napomena (opciono)</label>
-    <textarea class="input" name="napomena">{html.escape(ref)}</textarea>
-  </div>
-  <button class="btn" type="submit">Potvrdi termin</button>
-  <div class="muted">Zona vremena: Europe/Podgorica</div>
-</form>
-</div>
-
-<script src="https://cdn.jsdelivr.net/npm/flatpickr"></script>
-<script src="https://cdn.jsdelivr.net/npm/flatpickr/dist/l10n/sr.js"></script>
-<script>
-flatpickr("#dt", {{
-    enableTime: true,
-    dateFormat: "Y-m-d H:i",
-    minDate: "today",
-    time_24hr: true,
-    locale: "sr"
-}});
-</script>
-</body>
-</html>"""
-        return html_form
+        return potvrdi_stranica().render(ime=ime, email=email, telefon=telefon, ref=ref)
 
     # POST: obrada + mail sa .ics i Google linkom
     ime = (request.form.get("ime") or "").strip()
@@ -523,16 +3037,23 @@ flatpickr("#dt", {{
     dt_str = (request.form.get("dt") or "").strip()
 
     try:
-        dt_local = datetime.strptime(dt_str, "%Y-%m-%d %H:%M").replace(tzinfo=ZoneInfo("Europe/Podgorica"))
+        dt_local = datetime.strptime(dt_str, "%Y-%m-%d %H:%M").replace(tzinfo=TZ)
     except Exception:
         return "Neispravan datum/vrijeme.", 400
 
-    duration_min = 60
+    duration_min = TERMIN_TRAJANJE_MIN
     telefon_norm = normalize_phone(telefon_raw) or telefon_raw
     when_txt = dt_local.strftime("%d.%m.%Y u %H:%M")
 
+    try:
+        rezervisi_termin(dt_local, duration_min, ime=ime, email=email, telefon=telefon_norm, napomena=napomena)
+    except TerminNijeSlobodan as e:
+        return f"{e} Izaberite drugi termin.", 409
+    except Exception as e:
+        print(f"DB write error (potvrdi_termin): {e}", flush=True)
+
     # LOKACIJA (Google Maps link)
-    maps_link = "https://maps.app.goo.gl/6L27g5GLfUGxs2fD8"
+    maps_link = MAPS_LINK
 
     # ICS link (ka /event.ics)
     ics_qs = urllib.parse.urlencode({
@@ -545,8 +3066,8 @@ flatpickr("#dt", {{
     ics_url = request.url_root.rstrip("/") + "/event.ics?" + ics_qs
 
     # Google Calendar link (UTC)
-    start_utc = dt_local.astimezone(ZoneInfo("UTC"))
-    end_utc   = (dt_local + timedelta(minutes=duration_min)).astimezone(ZoneInfo("UTC"))
+    start_utc = dt_local.astimezone(UTC)
+    end_utc   = (dt_local + timedelta(minutes=duration_min)).astimezone(UTC)
     gcal_qs = urllib.parse.urlencode({
         "action": "TEMPLATE",
         "text": f"Termin — {ime or 'Pacijent'}",
@@ -558,56 +3079,15 @@ flatpickr("#dt", {{
     google_url = f"https://calendar.google.com/calendar/render?{gcal_qs}"
 
     # Tekst i HTML maila
-    body_txt = (
-        "Termin kod stomatologa\n\n"
-        f"Ime i prezime: {ime or '—'}\n"
-        f"E-pošta: {email or '—'}\n"
-        f"Telefon: {telefon_norm or '—'}\n"
-        f"Termin: {when_txt} (Europe/Podgorica)\n"
-        f"Napomena: {napomena or '—'}\n\n"
-        f"Dodaj u kalendar (.ics): {ics_url}\n"
-        f"Dodaj u Google Kalendar: {google_url}\n"
-        f"Lokacija (Google Maps): {maps_link}\n"
-    )
-
-    body_html = f"""
-<html><body style="font-family:Arial,sans-serif; font-size:14px; color:#111;">
-  <h2>
-    Termin kod stomatologa — {html.escape(when_txt)}
-    <span style="color:#6b7280; font-size:14px;">(Europe/Podgorica)</span>
-  </h2>
-
-  <p><b>Ime i prezime:</b> {html.escape(ime or '—')}</p>
-  <p><b>E-pošta:</b> {html.escape(email or '—')}</p>
-  <p><b>Telefon:</b> {html.escape(telefon_norm or '—')}</p>
-  <p><b>Napomena:</b><br>{html.escape(napomena or '—').replace('\\n','<br>')}</p>
-
-  <p style="margin:12px 0;">
-    <a href="{html.escape(ics_url)}" style="display:inline-block;background:#111827;color:#fff;
-       padding:10px 14px;border-radius:8px;text-decoration:none;font-weight:700;">
-       Dodaj u kalendar (.ics)
-    </a>
-  </p>
-
-  <p style="margin:12px 0;">
-    <a href="{html.escape(google_url)}" style="display:inline-block;background:#1a73e8;color:#fff;
-       padding:10px 14px;border-radius:8px;text-decoration:none;font-weight:700;">
-       Dodaj u Google Kalendar
-    </a>
-  </p>
-
-  <p style="margin:12px 0;">
-    <a href="{html.escape(maps_link)}" style="display:inline-block;background:#10b981;color:#fff;
-       padding:10px 14px;border-radius:8px;text-decoration:none;font-weight:700;">
-       Otvori lokaciju (Google Maps)
-    </a>
-  </p>
-</body></html>
-"""
+    sadrzaj = {
+        "ime": ime, "email": email, "telefon": telefon_norm, "napomena": napomena, "when_txt": when_txt,
+        "ics_url": ics_url, "google_url": google_url, "maps_link": maps_link,
+    }
+    body_txt = mail_sablon("mail/termin.txt").render(sadrzaj)
+    body_html = mail_sablon("mail/termin.html").render(sadrzaj)
 
     # priprema i slanje maila (+ priložimo .ics za bolju kompatibilnost)
-    user   = os.environ.get("GMAIL_USER")
-    app_pw = (os.environ.get("GMAIL_APP_PASSWORD") or "").replace(" ", "")
+    user, app_pw = gmail_kredencijali()
     if not user or not app_pw:
         return "Mail nije konfigurisan (GMAIL_USER/GMAIL_APP_PASSWORD).", 200
 
@@ -620,9 +3100,7 @@ flatpickr("#dt", {{
     )
 
     try:
-        msg = EmailMessage()
-        msg["From"] = formataddr(("POTVRDA TERMINA", user))
-        msg["To"] = "dentalabplaner@gmail.com"
+        msg = nova_poruka("POTVRDA TERMINA", user)
         if email:
             msg["Cc"] = email
             msg["Reply-To"] = email
@@ -637,17 +3115,397 @@ flatpickr("#dt", {{
             filename="termin.ics",
         )
 
-        context = ssl.create_default_context()
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465, context=context) as smtp:
-            smtp.login(user, app_pw)
-            smtp.send_message(msg)
+        stavi_u_red(msg, opis="potvrdi_termin")
     except Exception as e:
-        print(f"Mail error (potvrdi_termin): {e}", flush=True)
+        print(f"Mail queue error (potvrdi_termin): {e}", flush=True)
         return "Greška pri slanju e-pošte.", 500
 
     return "Termin je potvrđen. Hvala!", 200
 
 
+# ---- kalendar feed (/calendar.ics) ----
+# Pretplata za telefone osoblja: radno vrijeme + posebni datumi + potvrđeni
+# termini. Feed se gradi inkrementalno (VEVENT po danu / po terminu se čuva i
+# ponovo renderuje samo kad mu se promijene podaci) i samo kad se promijeni
+# data.json, tabela termini ili datum.
+FEED_DANA_NAZAD = int(os.environ.get("FEED_DANA_NAZAD", "14"))
+FEED_DANA_NAPRIJED = int(os.environ.get("FEED_DANA_NAPRIJED", "90"))
+FEED_MAX_AGE = int(os.environ.get("FEED_MAX_AGE", "300"))
+# feed sadrži imena i kontakte pacijenata: bez podešenog tokena ruta ne postoji (404)
+KALENDAR_TOKEN = os.environ.get("KALENDAR_TOKEN", "")
+MAPS_LINK = "https://maps.app.goo.gl/6L27g5GLfUGxs2fD8"
+
+class KalendarFeed:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.kljuc = None
+        self.dani = {}     # datum -> ((start, end, poseban), vevent)
+        self.termini = {}  # id -> vevent
+        self.tijelo = ""
+        self.etag = ""
+        self.izmijenjeno = datetime.now(UTC).replace(microsecond=0)
+        self.stats = {"pozivi": 0, "gradnje": 0, "renderovano": 0}
+
+    def _vevent_dana(self, d, start, end, poseban):
+        datum = d.strftime("%Y-%m-%d")
+        if start is None or end is None:
+            if not poseban:
+                return ""  # redovan neradni dan (nedjelja) nije događaj
+            return _ics_vevent(
+                f"zatvoreno-{datum}@dentalab", "Ordinacija zatvorena",
+                d, d + timedelta(days=1), "Poseban neradni dan", all_day=True,
+            )
+        return _ics_vevent(
+            f"radno-{datum}@dentalab",
+            f"Radno vrijeme {sat_label(start)}–{sat_label(end)}",
+            _lokalno_vrijeme(d, start), _lokalno_vrijeme(d, end),
+            "Poseban raspored" if poseban else "",
+        )
+
+    @staticmethod
+    def _vevent_termina(r):
+        start = datetime.fromtimestamp(r["start_utc"], TZ)
+        opis = "\n".join(x for x in (
+            f"E-pošta: {r['email']}" if r["email"] else "",
+            f"Telefon: {r['telefon']}" if r["telefon"] else "",
+            r["napomena"],
+        ) if x)
+        return _ics_vevent(
+            f"termin-{r['id']}@dentalab",
+            f"Termin — {r['ime'] or 'Pacijent'}",
+            start, start + timedelta(minutes=r["trajanje_min"]),
+            opis, MAPS_LINK,
+            dtstamp=_ics_ts(datetime.fromtimestamp(r["kreirano"], UTC)),
+        )
+
+    def get(self):
+        """Vraća (tijelo, etag, last_modified); gradi samo ako se izvor promijenio."""
+        kljuc = (raspored_verzija(), termini_verzija(), now_podgorica().date())
+        posebni = posebni_kes.trenutno()
+        danas = kljuc[2]
+        with self.lock:
+            self.stats["pozivi"] += 1
+            if kljuc != self.kljuc:
+                self._izgradi(posebni, danas)
+                self.kljuc = kljuc
+            return self.tijelo, self.etag, self.izmijenjeno
+
+    def _izgradi(self, posebni, danas):
+        self.stats["gradnje"] += 1
+        od = danas - timedelta(days=FEED_DANA_NAZAD)
+        dani = {}
+        for i in range(FEED_DANA_NAZAD + FEED_DANA_NAPRIJED + 1):
+            d = od + timedelta(days=i)
+            start, end = radno_vrijeme_za_datum(d, posebni)
+            poseban = d.strftime("%Y-%m-%d") in posebni or pravila_raspored.za_datum(d) is not None
+            sati = (start, end, poseban)
+            staro = self.dani.get(d)
+            if staro and staro[0] == sati:
+                dani[d] = staro
+            else:
+                dani[d] = (sati, self._vevent_dana(d, *sati))
+                self.stats["renderovano"] += 1
+        self.dani = dani
+
+        od_utc = int(_lokalno_vrijeme(od, 0).timestamp())
+        termini = {}
+        for r in db().execute(
+            "SELECT id, start_utc, trajanje_min, ime, email, telefon, napomena, kreirano "
+            "FROM termini WHERE start_utc >= ? ORDER BY start_utc, id", (od_utc,)
+        ):
+            v = self.termini.get(r["id"])
+            if v is None:
+                v = self._vevent_termina(r)
+                self.stats["renderovano"] += 1
+            termini[r["id"]] = v
+        self.termini = termini
+
+        tijelo = _ics_kalendar(
+            [v for _, v in dani.values()] + list(termini.values()),
+            prodid="-//Dentalab//Raspored//EN",
+            zaglavlje=(
+                "X-WR-CALNAME:Dentalab\r\n"
+                "X-WR-TIMEZONE:Europe/Podgorica\r\n"
+                "REFRESH-INTERVAL;VALUE=DURATION:PT1H\r\n"
+                "X-PUBLISHED-TTL:PT1H\r\n"
+            ),
+        )
+        etag = hashlib.sha1(tijelo.encode("utf-8")).hexdigest()
+        if etag != self.etag:
+            self.izmijenjeno = datetime.now(UTC).replace(microsecond=0)
+        self.tijelo, self.etag = tijelo, etag
+
+kalendar_feed = KalendarFeed()
+
+@app.get("/calendar.ics")
+def calendar_ics():
+    if not KALENDAR_TOKEN:
+        abort(404)
+    if not hmac.compare_digest(request.args.get("token", "").encode(), KALENDAR_TOKEN.encode()):
+        abort(403)
+    tijelo, etag, izmijenjeno = kalendar_feed.get()
+    resp = Response(
+        tijelo,
+        mimetype="text/calendar",
+        headers={"Content-Disposition": 'inline; filename="dentalab.ics"'},
+    )
+    resp.set_etag(etag)
+    resp.last_modified = izmijenjeno
+    resp.cache_control.private = True
+    resp.cache_control.max_age = FEED_MAX_AGE
+    return resp.make_conditional(request)
+
+
+# ---- podsjetnici za termine (24h i 2h prije) ----
+# Heap (rok_utc, id) drži samo podsjetnike iz narednih PODSJETNIK_HORIZONT_S i
+# puni se indeksiranim upitom po rok_utc (parcijalni indeks nad neposlatim),
+# pa tick ne prolazi kroz sve buduće termine. Isti upit vraća i zaostale
+# podsjetnike -> catch-up kad se instanca probudi. Heap se puni iznova kad se
+# promijeni termini_verzija ili istekne horizont. Jedan raspoređivač za sve
+# workere: ko drži neblokirajući flock na PODSJETNIK_LOCK, taj šalje.
+PODSJETNIK_HORIZONT_S = 6 * 3600
+PODSJETNIK_TICK_S = float(os.environ.get("PODSJETNIK_TICK_S", "60"))
+PODSJETNIK_LOCK = DB_PATH + ".podsjetnici.lock"
+PODSJETNIK_STATS = {"poslato": 0, "preskoceno": 0}
+
+def mail_podsjetnik(r, user):
+    dt_local = datetime.fromtimestamp(r["start_utc"], TZ)
+    when_txt = dt_local.strftime("%d.%m.%Y u %H:%M")
+    sadrzaj = {
+        "ime": r["ime"], "when_txt": when_txt, "vrsta": r["vrsta"],
+        "telefon": r["telefon"], "email": r["email"], "maps_link": MAPS_LINK,
+    }
+    msg = nova_poruka("DENTALAB PODSJETNIK", user, za=r["email"] or MAIL_ZA)
+    if r["email"]:
+        msg["Reply-To"] = MAIL_ZA
+    msg["Subject"] = f"Podsjetnik: termin {when_txt}"
+    msg.set_content(mail_sablon("mail/podsjetnik.txt").render(sadrzaj))
+    msg.add_alternative(mail_sablon("mail/podsjetnik.html").render(sadrzaj), subtype="html")
+    ics_text = build_ics(
+        summary=f"Termin — {r['ime'] or 'Pacijent'}",
+        dt_local=dt_local,
+        duration_min=r["trajanje_min"],
+        description=r["napomena"] or "",
+        location=MAPS_LINK,
+    )
+    msg.add_attachment(ics_text.encode("utf-8"), maintype="text", subtype="calendar", filename="termin.ics")
+    return msg
+
+class RasporedPodsjetnika:
+    def __init__(self):
+        self.heap = []
+        self.verzija = None
+        self.horizont = 0.0
+        self.budjenje = threading.Event()
+
+    def _napuni(self, sada):
+        self.verzija = termini_verzija()
+        self.horizont = sada + PODSJETNIK_HORIZONT_S
+        redovi = db().execute(
+            "SELECT rok_utc, id FROM podsjetnici WHERE poslato IS NULL AND rok_utc <= ? ORDER BY rok_utc",
+            (self.horizont,),
+        ).fetchall()
+        self.heap = [(r[0], r[1]) for r in redovi]  # sortirana lista je već heap
+
+    def korak(self, sada=None):
+        """Pošalje dospjele podsjetnike; vraća sekunde do sljedećeg roka (ili horizonta)."""
+        sada = time.time() if sada is None else sada
+        if self.verzija != termini_verzija() or sada >= self.horizont:
+            self._napuni(sada)
+        dospjeli = []
+        while self.heap and self.heap[0][0] <= sada:
+            dospjeli.append(heapq.heappop(self.heap)[1])
+        try:
+            for i in range(0, len(dospjeli), 500):
+                self._obradi(dospjeli[i:i + 500], sada)
+        except Exception:
+            # heap ih je već izbacio; bilo koja greška (render, zaključana baza,
+            # spool) -> ponovo napuni iz baze u sljedećem koraku, a već
+            # označeni (poslato IS NOT NULL) se neće ponoviti
+            self.verzija = None
+            raise
+        sljedeci = self.heap[0][0] if self.heap else self.horizont
+        return max(0.0, min(sljedeci, self.horizont) - sada)
+
+    def _obradi(self, ids, sada):
+        redovi = db().execute(
+            "SELECT p.id, p.termin_id, p.vrsta, p.rok_utc, t.start_utc, t.trajanje_min, "
+            "t.ime, t.email, t.telefon, t.napomena "
+            "FROM podsjetnici p JOIN termini t ON t.id = p.termin_id "
+            f"WHERE p.poslato IS NULL AND p.id IN ({','.join('?' * len(ids))})",
+            ids,
+        ).fetchall()
+        # poslije dužeg sna mogu dospjeti i 24h i 2h za isti termin -> samo najkasniji
+        najkasniji = {}
+        for r in redovi:
+            if r["termin_id"] not in najkasniji or r["rok_utc"] > najkasniji[r["termin_id"]]["rok_utc"]:
+                najkasniji[r["termin_id"]] = r
+        user, _ = gmail_kredencijali()
+        for r in redovi:
+            saljemo = r is najkasniji[r["termin_id"]] and r["start_utc"] > sada
+            msg = mail_podsjetnik(r, user) if saljemo else None
+            # prvo COMMIT oznake, pa tek onda spool: stavi_u_red fsync-uje fajl
+            # odmah, pa bi neuspio COMMIT poslije njega ostavio mail u redu a red
+            # neoznačen -> isti podsjetnik ponovo pri sljedećem punjenju heap-a
+            with transakcija() as con:
+                cur = con.execute(
+                    "UPDATE podsjetnici SET poslato = ?, status = ? WHERE id = ? AND poslato IS NULL",
+                    (int(sada), "poslato" if saljemo else "preskoceno", r["id"]),
+                )
+            if cur.rowcount != 1:
+                continue  # drugi proces ga je već obradio
+            if saljemo:
+                try:
+                    stavi_u_red(msg, opis=f"podsjetnik {r['vrsta']}")
+                except Exception:
+                    # spool nije upisan -> vrati red da ga sljedeći krug pokuša ponovo
+                    db().execute("UPDATE podsjetnici SET poslato = NULL, status = '' WHERE id = ?", (r["id"],))
+                    raise
+            PODSJETNIK_STATS["poslato" if saljemo else "preskoceno"] += 1
+
+raspored_podsjetnika = RasporedPodsjetnika()
+
+def _dopuni_podsjetnike():
+    """Podsjetnici za buduće termine koji ih nemaju (npr. zakazani prije ove verzije)."""
+    sada = int(time.time())
+    with transakcija() as con:
+        for sati in PODSJETNICI_SATI:
+            s = int(sati * 3600)
+            con.execute(
+                "INSERT OR IGNORE INTO podsjetnici (termin_id, vrsta, rok_utc) "
+                "SELECT id, ?, start_utc - ? FROM termini WHERE start_utc > ?",
+                (_vrsta_podsjetnika(sati), s, sada + s),
+            )
+
+def _podsjetnik_radnik():
+    lider = False
+    lock = open(PODSJETNIK_LOCK, "a")
+    while True:
+        if not lider:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                lider = True
+            except OSError:
+                time.sleep(PODSJETNIK_TICK_S * 5)  # drugi worker je raspoređivač
+                continue
+            _dopuni_podsjetnike()
+        cekaj = PODSJETNIK_TICK_S
+        try:
+            if all(gmail_kredencijali()):
+                cekaj = min(cekaj, raspored_podsjetnika.korak())
+        except Exception as e:
+            print(f"Reminder error: {e}", flush=True)
+        raspored_podsjetnika.budjenje.wait(cekaj)
+        raspored_podsjetnika.budjenje.clear()
+
+def podsjetnici_na_cekanju():
+    return db().execute("SELECT COUNT(*) FROM podsjetnici WHERE poslato IS NULL").fetchone()[0]
+
+# ---- /healthz i /metrics ----
+def _moze_pisati(path):
+    """Postojeći fajl mora biti upisiv; nepostojeći – njegov direktorijum."""
+    if os.path.exists(path):
+        return os.access(path, os.W_OK)
+    return os.access(os.path.dirname(path) or ".", os.W_OK)
+
+@app.get("/healthz")
+def healthz():
+    provjere = {
+        "csv": _moze_pisati(segment_dnevnika(mjesec_dnevnika(None))),
+        "data_json": _moze_pisati(DATA_FILE) and posebni_kes.greska is None,
+    }
+    try:
+        db().execute("SELECT 1").fetchone()
+        provjere["db"] = True
+    except sqlite3.Error:
+        provjere["db"] = False
+    ok = all(provjere.values())
+    return jsonify(ok=ok, **provjere), (200 if ok else 503)
+
+def _broj_u_spoolu(stanje):
+    try:
+        return sum(1 for ime in os.listdir(os.path.join(MAIL_SPOOL_DIR, stanje)) if ime.endswith(".json"))
+    except FileNotFoundError:
+        return 0
+
+@app.get("/metrics")
+def metrics():
+    out = ["# HELP dentalab_requests_total Broj zahtjeva po metodi, ruti i statusu.",
+           "# TYPE dentalab_requests_total counter"]
+    with _zahtjevi_lock:
+        brojevi = sorted(ZAHTJEVI_BROJ.items())
+    for (metoda, ruta, status), n in brojevi:
+        out.append(f'dentalab_requests_total{{method="{metoda}",route="{_prom_escape(ruta)}",status="{status}"}} {n}')
+    out += ZAHTJEVI_HIST.render()
+    out += KORACI_HIST.render()
+
+    def gauge(ime, opis, vrijednost, tip="gauge"):
+        out.extend([f"# HELP {ime} {opis}", f"# TYPE {ime} {tip}", f"{ime} {vrijednost}"])
+
+    gauge("dentalab_mail_queue_pending", "Poruke u mail spool-u na čekanju.", _broj_u_spoolu("pending"))
+    gauge("dentalab_mail_queue_failed", "Poruke od kojih je radnik odustao.", _broj_u_spoolu("failed"))
+    gauge("dentalab_reminders_pending", "Podsjetnici koji još nisu poslati.", podsjetnici_na_cekanju())
+    gauge("dentalab_reminders_sent_total", "Poslati podsjetnici (ovaj proces).", PODSJETNIK_STATS["poslato"], "counter")
+    gauge("dentalab_reminders_skipped_total", "Preskočeni podsjetnici (termin prošao / kasniji poslat).",
+          PODSJETNIK_STATS["preskoceno"], "counter")
+    gauge("dentalab_index_cache_hits_total", "Naslovna iz keša (ovaj proces).", kes_naslovne.stats["pogoci"], "counter")
+    gauge("dentalab_index_cache_misses_total", "Naslovna renderovana (ovaj proces).",
+          kes_naslovne.stats["promasaji"], "counter")
+    gauge("dentalab_index_not_modified_total", "Naslovna: 304 odgovori (ovaj proces).", kes_naslovne.stats["304"], "counter")
+    segmenata, bajtova = velicina_dnevnika()
+    gauge("dentalab_log_segments", "Mjesečni segmenti dnevnika poruka na disku.", segmenata)
+    gauge("dentalab_log_bytes", "Veličina dnevnika poruka na disku (bajtova).", bajtova)
+    gauge("dentalab_mail_digest_pending", "Poruke skupljene za sljedeći digest.", _broj_u_spoolu("digest"))
+    gauge("dentalab_mail_sent_total", "Poslate poruke (ovaj proces).", MAIL_STATS["poslato"], "counter")
+    gauge("dentalab_smtp_sessions_new_total", "Nove SMTP sesije.", smtp_pool.stats["nove"], "counter")
+    gauge("dentalab_smtp_sessions_reused_total", "Ponovo korištene SMTP sesije.", smtp_pool.stats["ponovo"], "counter")
+    gauge("dentalab_schedule_cache_hits_total", "Pogoci keša data.json.", posebni_kes.hits, "counter")
+    gauge("dentalab_schedule_cache_misses_total", "Promašaji keša data.json.", posebni_kes.misses, "counter")
+    out += ["# HELP dentalab_rejected_total Odbijeni zahtjevi (429) po razlogu.",
+            "# TYPE dentalab_rejected_total counter"]
+    out += [f'dentalab_rejected_total{{reason="{r}"}} {n}' for r, n in sorted(ODBIJENO.items())]
+    gauge("dentalab_idempotent_replays_total", "Duplikati forme odgovoreni iz keša.", idempotentni_kes.ponovljeno, "counter")
+    gauge("dentalab_sse_subscribers", "Otvoreni /status/stream klijenti.", len(status_emiter.pretplatnici))
+    return Response("\n".join(out) + "\n", mimetype="text/plain; version=0.0.4")
+
+# ---- zagrijavanje (gunicorn --preload) ----
+# Sa --preload se modul učitava u master procesu prije fork-a: sve što se
+# ovdje napuni (data.json/pravila, vremenska linija, kompajlirani šabloni,
+# Jinja keš za index.html) workeri naslijede, pa prvi zahtjev poslije buđenja
+# ne plaća ništa od toga. Mail paket ostaje lijen – treba ga tek radnik.
+WARMUP = os.environ.get("WARMUP", "1") != "0"
+
+def zagrijavanje():
+    t0 = time.perf_counter()
+    sada = now_podgorica()
+    posebni = ucitaj_posebne_datume()
+    ucitaj_pravila()
+    vremenska_linija.status(sada)
+    termini_indeks.slobodni(sada.date(), posebni)
+    with app.test_request_context("/"):
+        index()
+    potvrdi_stranica()
+    for tip in ("email", "phone", "text"):
+        for povratnik in (False, True):
+            mail_predrenderovan("mail/poruka.txt", _POLJA_PORUKE, tip, povratnik)
+            mail_predrenderovan("mail/poruka_blok.html", _POLJA_PORUKE, tip, povratnik)
+    mail_predrenderovan("mail/poruka.html", ("blok",))
+    for ime in ("mail/digest.html", "mail/termin.txt", "mail/termin.html"):
+        mail_sablon(ime)
+    # SQLite konekcija iz master procesa ne smije se koristiti poslije fork-a
+    con = getattr(_db_local, "con", None)
+    if con is not None:
+        con.close()
+        _db_local.con = None
+    print(f"Zagrijavanje: {(time.perf_counter() - t0) * 1000:.1f} ms", flush=True)
+
+if WARMUP:
+    try:
+        zagrijavanje()
+    except Exception as e:
+        print(f"Warmup error: {e}", flush=True)
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5098))
     app.run(host="0.0.0.0", port=port, debug=True)
@@ -0,0 +1,309 @@
+"""
+Benchmark / load test: app pod gunicorn-om + lokalni fake SMTP, miješan
+saobraćaj na fiksnoj konkurentnosti, p50/p95/p99 i throughput po ruti.
+
+    python tools/bench.py                          # 20 s, 8 klijenata
+    python tools/bench.py --duration 60 --concurrency 16 --smtp-delay 0.8
+    python tools/bench.py --save-baseline tools/bench_baseline.json
+    python tools/bench.py --baseline tools/bench_baseline.json   # regresija
+
+U regresionom režimu izlazni kod je 1 ako je p95 neke rute porastao, ili
+throughput pao, za više od --tolerance (podrazumijevano 25%).
+Sve (CSV, baza, mail spool) ide u privremeni direktorijum; data.json se ne
+mijenja jer benchmark ne zove admin rute.
+"""
+import argparse, http.client, json, os, random, shutil, signal, socket, subprocess, sys, tempfile, threading, time
+import urllib.parse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_smtp  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ruta -> težina u miksu (podrazumijevano: landing page dominira)
+DEFAULT_MIX = "index=60,status=15,ics=10,poruka=10,termin=5"
+
+
+def slobodan_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def zahtjev_index(rnd):
+    return "GET", "/", None, {}
+
+
+def zahtjev_status(rnd):
+    return "GET", "/api/status", None, {}
+
+
+def zahtjev_ics(rnd):
+    # ograničen skup upita -> realan odnos pogodaka LRU keša
+    dan = datetime(2030, 1, 1) + timedelta(days=rnd.randrange(50), hours=10)
+    qs = urllib.parse.urlencode({"title": "Termin", "start": dan.strftime("%Y-%m-%d %H:%M"), "dur": 60})
+    return "GET", "/event.ics?" + qs, None, {}
+
+
+def zahtjev_poruka(rnd):
+    body = json.dumps({
+        "ime": f"Bench {rnd.randrange(10**6)}",
+        "kontakt": f"bench{rnd.randrange(10**6)}@example.com",
+        "poruka": "Benchmark poruka " + str(rnd.random()),
+    })
+    return "POST", "/posalji_poruku", body, {"Content-Type": "application/json"}
+
+
+def zahtjev_termin(rnd):
+    # nasumičan radni dan/sat u dalekoj budućnosti; 409 (zauzeto) je očekivan ishod
+    dan = datetime.now() + timedelta(days=30 + rnd.randrange(300))
+    while dan.weekday() > 4:
+        dan += timedelta(days=1)
+    dt = dan.replace(hour=10 + rnd.randrange(9), minute=rnd.choice((0, 30)))
+    body = urllib.parse.urlencode({"ime": "Bench", "email": "bench@example.com", "dt": dt.strftime("%Y-%m-%d %H:%M")})
+    return "POST", "/potvrdi_termin", body, {"Content-Type": "application/x-www-form-urlencoded"}
+
+
+RUTE = {
+    "index": zahtjev_index,
+    "status": zahtjev_status,
+    "ics": zahtjev_ics,
+    "poruka": zahtjev_poruka,
+    "termin": zahtjev_termin,
+}
+
+
+def parse_mix(s):
+    mix = {}
+    for dio in s.split(","):
+        ime, _, w = dio.partition("=")
+        if ime not in RUTE:
+            raise SystemExit(f"Nepoznata ruta u miksu: {ime} (poznate: {', '.join(RUTE)})")
+        mix[ime] = float(w or 1)
+    return mix
+
+
+def percentil(sortirano, p):
+    if not sortirano:
+        return 0.0
+    k = max(0, min(len(sortirano) - 1, int(round(p / 100.0 * len(sortirano) + 0.5)) - 1))
+    return sortirano[k]
+
+
+class Klijent(threading.Thread):
+    def __init__(self, port, mix, kraj, seed, rezultati, lock):
+        super().__init__(daemon=True)
+        self.port = port
+        self.imena = list(mix)
+        self.tezine = [mix[i] for i in self.imena]
+        self.kraj = kraj
+        self.rnd = random.Random(seed)
+        self.rezultati = rezultati
+        self.lock = lock
+        self.conn = None
+
+    def run(self):
+        lokalno = {}
+        while time.monotonic() < self.kraj:
+            ime = self.rnd.choices(self.imena, self.tezine)[0]
+            metoda, putanja, body, headers = RUTE[ime](self.rnd)
+            t0 = time.perf_counter()
+            try:
+                if self.conn is None:
+                    self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+                self.conn.request(metoda, putanja, body=body, headers=headers)
+                resp = self.conn.getresponse()
+                resp.read()
+                status = resp.status
+            except (OSError, http.client.HTTPException):
+                status = 0
+                self.conn = None
+            dt = time.perf_counter() - t0
+            r = lokalno.setdefault(ime, {"lat": [], "statusi": {}})
+            r["lat"].append(dt)
+            r["statusi"][status] = r["statusi"].get(status, 0) + 1
+        with self.lock:
+            for ime, r in lokalno.items():
+                g = self.rezultati.setdefault(ime, {"lat": [], "statusi": {}})
+                g["lat"].extend(r["lat"])
+                for st, n in r["statusi"].items():
+                    g["statusi"][st] = g["statusi"].get(st, 0) + n
+
+
+def cekaj_server(port, timeout=30):
+    kraj = time.monotonic() + timeout
+    while time.monotonic() < kraj:
+        try:
+            c = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            c.request("GET", "/healthz")
+            if c.getresponse().status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def pokreni(args):
+    tmp = tempfile.mkdtemp(prefix="dentalab-bench-")
+    smtp_port = slobodan_port()
+    http_port = slobodan_port()
+    smtp = fake_smtp.serve(port=smtp_port, delay=args.smtp_delay)
+
+    env = dict(os.environ)
+    env.update({
+        "CSV_PATH": os.path.join(tmp, "poruke.csv"),
+        "MAIL_SPOOL_DIR": os.path.join(tmp, "mail_spool"),
+        "SMTP_HOST": "127.0.0.1",
+        "SMTP_PORT": str(smtp_port),
+        "SMTP_SSL": "0",
+        "GMAIL_USER": "bench@example.com",
+        "GMAIL_APP_PASSWORD": "bench",
+        # sav saobraćaj dolazi sa 127.0.0.1; limiter se mjeri kroz --env RATE_IP=...
+        "RATE_IP": "0",
+        "RATE_KONTAKT": "0",
+    })
+    env.update(dict(kv.split("=", 1) for kv in args.env))
+
+    cmd = [
+        sys.executable, "-m", "gunicorn", "app:app",
+        "--bind", f"127.0.0.1:{http_port}",
+        "--workers", str(args.workers), "--threads", str(args.threads),
+        "--timeout", "120", "--preload", "--log-level", "warning",
+    ]
+    server = subprocess.Popen(cmd, cwd=ROOT, env=env)
+    try:
+        if not cekaj_server(http_port):
+            raise SystemExit("Server se nije podigao (gunicorn instaliran? pip install -r requirements.txt)")
+
+        if args.warmup:
+            kraj = time.monotonic() + args.warmup
+            tmp_rez = {}
+            for k in [Klijent(http_port, parse_mix(args.mix), kraj, 10_000 + i, tmp_rez, threading.Lock())
+                      for i in range(args.concurrency)]:
+                k.start()
+            time.sleep(args.warmup + 0.5)
+
+        rezultati, lock = {}, threading.Lock()
+        kraj = time.monotonic() + args.duration
+        klijenti = [Klijent(http_port, parse_mix(args.mix), kraj, args.seed + i, rezultati, lock)
+                    for i in range(args.concurrency)]
+        t0 = time.monotonic()
+        for k in klijenti:
+            k.start()
+        for k in klijenti:
+            k.join()
+        trajanje = time.monotonic() - t0
+
+        # sačekaj da mail radnik isprazni red (ne ulazi u latenciju zahtjeva)
+        kraj_maila = time.monotonic() + args.drain
+        pending = os.path.join(tmp, "mail_spool", "pending")
+        while time.monotonic() < kraj_maila and os.path.isdir(pending) and os.listdir(pending):
+            time.sleep(0.2)
+        ostalo = len(os.listdir(pending)) if os.path.isdir(pending) else 0
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        smtp.shutdown()
+        if not args.keep:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    izvjestaj = {
+        "meta": {
+            "vrijeme": datetime.now().isoformat(timespec="seconds"),
+            "trajanje_s": round(trajanje, 2),
+            "concurrency": args.concurrency,
+            "workers": args.workers,
+            "threads": args.threads,
+            "smtp_delay": args.smtp_delay,
+            "mix": args.mix,
+            "mail_primljeno": fake_smtp.STATS["poruka"],
+            "mail_smtp_konekcija": fake_smtp.STATS["konekcija"],
+            "mail_ostalo_u_redu": ostalo,
+        },
+        "rute": {},
+    }
+    for ime, r in sorted(rezultati.items()):
+        lat = sorted(r["lat"])
+        izvjestaj["rute"][ime] = {
+            "zahtjeva": len(lat),
+            "rps": round(len(lat) / trajanje, 2),
+            "p50_ms": round(percentil(lat, 50) * 1000, 2),
+            "p95_ms": round(percentil(lat, 95) * 1000, 2),
+            "p99_ms": round(percentil(lat, 99) * 1000, 2),
+            "max_ms": round(lat[-1] * 1000, 2) if lat else 0.0,
+            "statusi": {str(k): v for k, v in sorted(r["statusi"].items())},
+        }
+    return izvjestaj
+
+
+def ispisi(izv):
+    m = izv["meta"]
+    print(f"\n{m['trajanje_s']} s, {m['concurrency']} klijenata, gunicorn {m['workers']}x{m['threads']}, "
+          f"smtp delay {m['smtp_delay']} s")
+    print(f"{'ruta':<8} {'zahtjeva':>9} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}  statusi")
+    for ime, r in izv["rute"].items():
+        print(f"{ime:<8} {r['zahtjeva']:>9} {r['rps']:>9} {r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9} "
+              f"{r['max_ms']:>9}  {r['statusi']}")
+    print(f"mail: primljeno {m['mail_primljeno']}, SMTP konekcija {m['mail_smtp_konekcija']}, "
+          f"ostalo u redu {m['mail_ostalo_u_redu']}")
+
+
+def uporedi(izv, baseline, tolerancija):
+    """Lista regresija (prazna = OK)."""
+    regresije = []
+    for ime, b in baseline.get("rute", {}).items():
+        r = izv["rute"].get(ime)
+        if r is None:
+            continue
+        if b["p95_ms"] > 0 and r["p95_ms"] > b["p95_ms"] * (1 + tolerancija):
+            regresije.append(f"{ime}: p95 {b['p95_ms']} -> {r['p95_ms']} ms")
+        if b["rps"] > 0 and r["rps"] < b["rps"] * (1 - tolerancija):
+            regresije.append(f"{ime}: rps {b['rps']} -> {r['rps']}")
+    return regresije
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Dentalab benchmark (gunicorn + fake SMTP).")
+    ap.add_argument("--duration", type=float, default=20.0, help="sekunde mjerenja")
+    ap.add_argument("--warmup", type=float, default=3.0, help="sekunde zagrijavanja (ne mjeri se)")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--threads", type=int, default=16)
+    ap.add_argument("--smtp-delay", type=float, default=0.5, help="kašnjenje fake SMTP-a po poruci")
+    ap.add_argument("--mix", default=DEFAULT_MIX, help=f"težine ruta (podrazumijevano {DEFAULT_MIX})")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--drain", type=float, default=30.0, help="max sekundi čekanja da se mail red isprazni")
+    ap.add_argument("--env", action="append", default=[], metavar="KEY=VAL", help="dodatne env varijable za app")
+    ap.add_argument("--out", help="upiši JSON izvještaj")
+    ap.add_argument("--save-baseline", metavar="PATH", help="sačuvaj rezultat kao baseline")
+    ap.add_argument("--baseline", metavar="PATH", help="uporedi sa baseline-om (regresioni režim)")
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    ap.add_argument("--keep", action="store_true", help="ne briši privremeni direktorijum")
+    args = ap.parse_args()
+
+    izv = pokreni(args)
+    ispisi(izv)
+    for path in filter(None, (args.out, args.save_baseline)):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(izv, f, ensure_ascii=False, indent=2)
+        print(f"Izvještaj upisan: {path}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regresije = uporedi(izv, baseline, args.tolerance)
+        if regresije:
+            print("\nREGRESIJA (tolerancija {:.0%}):".format(args.tolerance))
+            for r in regresije:
+                print("  " + r)
+            sys.exit(1)
+        print("\nBez regresija u odnosu na baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Micro-benchmark: render mail tijela i stranice /potvrdi_termin.
+
+Poredi stari način (f-string + html.escape + urlencode + build_mailto
+definisan u svakom pozivu) sa kompajliranim Jinja šablonima iz app.py, i
+za stranicu: kompajliranje po pozivu / keširan šablon / predrenderovani
+statični komadi (PredrenderovanSablon).
+
+    python tools/bench_templates.py            # 20000 iteracija
+    python tools/bench_templates.py -n 100000
+"""
+import argparse, html, os, re, sys, tempfile, timeit, urllib.parse
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("CSV_PATH", os.path.join(tempfile.mkdtemp(prefix="dentalab-tpl-"), "poruke.csv"))
+import app as A  # noqa: E402
+
+PODACI = {
+    "ime": "Marko Marković",
+    "kontakt": "+382 67 123 456",
+    "poruka": "Dobar dan,\nda li imate slobodan termin u petak?\nHvala",
+    "ts": datetime(2025, 3, 14, 9, 30, tzinfo=ZoneInfo("Europe/Podgorica")).isoformat(),
+    "ip": "203.0.113.7",
+    "url_base": "https://dentalab.example",
+}
+
+
+# ---- stari način (kopija koda prije prelaska na šablone) ----
+def staro_kontakt(ime, kontakt, poruka, ts, ip, url_base):
+    vrijeme = datetime.fromisoformat(ts)
+    kontakt_tip, kontakt_val = A.classify_kontakt(kontakt)
+    if kontakt_tip == "email":
+        kontakt_linija_txt = f"E-mail: {kontakt_val}"
+        kontakt_link_html = f'<a href="mailto:{html.escape(kontakt_val)}" style="color:#2563eb;text-decoration:none;">{html.escape(kontakt_val)}</a>'
+    elif kontakt_tip == "phone":
+        tel_uri = "tel:" + re.sub(r"[^\d+]", "", kontakt_val)
+        kontakt_linija_txt = f"Telefon: {kontakt_val}"
+        kontakt_link_html = f'<a href="{html.escape(tel_uri)}" style="color:#2563eb;text-decoration:none;">{html.escape(kontakt_val)}</a>'
+    else:
+        kontakt_linija_txt = f"Kontakt: {kontakt_val or '—'}"
+        kontakt_link_html = html.escape(kontakt_val or "—")
+    body_txt = (
+        f"Ime i prezime: {ime or '—'}\n{kontakt_linija_txt}\n\n"
+        f"Poruka:\n{poruka}\n\nVrijeme: {ts}\nIP: {ip}\n"
+    )
+    confirm_qs = urllib.parse.urlencode({
+        "ime": ime or "",
+        "email": kontakt_val if (kontakt_tip == "email") else "",
+        "telefon": kontakt_val if (kontakt_tip == "phone") else "",
+        "ref": f"Ref: poruka sa sajta {vrijeme.strftime('%d.%m.%Y %H:%M')}",
+    })
+    confirm_url = f"{url_base}/potvrdi_termin?{confirm_qs}"
+    confirm_btn_html = (
+        f'<a href="{html.escape(confirm_url)}" '
+        'style="display:inline-block;background:#111827;color:#fff;'
+        'padding:12px 18px;border-radius:8px;text-decoration:none;font-weight:700;">'
+        'Potvrdi termin</a>'
+    )
+    quick_reply_to = kontakt_val if (kontakt_tip == "email" and kontakt_val) else A.MAIL_ZA
+
+    def build_mailto(to_email, subject, body):
+        qs = {"subject": subject, "body": body}
+        return f"mailto:{to_email}?{urllib.parse.urlencode(qs)}"
+
+    hvala_link = build_mailto(quick_reply_to, f"Hvala na poruci – {ime or 'poštovani/na'}", A.HVALA_TELO)
+    prosledjujem_link = build_mailto(
+        quick_reply_to, f"Vaša poruka je prosleđena – {ime or 'poštovani/na'}", A.PROSLEDJUJEM_TELO
+    )
+    poruka_html = html.escape(poruka).replace("\n", "<br>")
+    body_html = f"""
+    <html><body style="font-family:Arial,Helvetica,sans-serif; font-size:14px; color:#111;">
+      <p><b>Ime i prezime:</b> {html.escape(ime or '—')}</p>
+      <p><b>Kontakt:</b> {kontakt_link_html}</p>
+      <p><b>Poruka:</b><br>{poruka_html}</p>
+      <hr style="border:none;border-top:1px solid #ddd;margin:12px 0">
+      <p style="color:#555;">
+        Vrijeme: {html.escape(ts)}<br>
+        IP: {html.escape(ip)}
+      </p>
+      <div style="margin:20px 0;text-align:center;">
+        {confirm_btn_html}
+      </div>
+      <p style="margin-top:20px;color:#555;">Brzi odgovori:</p>
+      <ul style="list-style:none;padding:0;margin:0;">
+        <li style="margin:6px 0;"><a href="{html.escape(hvala_link)}" style="color:#2563eb;text-decoration:none;">Hvala</a></li>
+        <li style="margin:6px 0;"><a href="{html.escape(prosledjujem_link)}" style="color:#2563eb;text-decoration:none;">Prosleđujem</a></li>
+      </ul>
+    </body></html>
+    """
+    return body_txt, body_html
+
+
+def novo_kontakt(**podaci):
+    st = A.kontakt_stavka(**podaci)
+    return st["txt"], A.mail_predrenderovan("mail/poruka.html", ("blok",)).render(blok=st["html"])
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", type=int, default=20000)
+    args = ap.parse_args()
+
+    with open(os.path.join(ROOT, "templates", "potvrdi_termin.html"), encoding="utf-8") as f:
+        izvor = f.read()
+    stranica = {"ime": "Marko <M>", "email": "marko@example.com", "telefon": "+38267123456", "ref": "Ref: poruka"}
+
+    # isti sadržaj – poređenje ima smisla
+    assert staro_kontakt(**PODACI)[0].strip() == novo_kontakt(**PODACI)[0].strip()
+    assert A.potvrdi_stranica().render(**stranica) == A.app.jinja_env.get_template("potvrdi_termin.html").render(
+        korak=A.SLOT_KORAK_MIN, **stranica)
+
+    testovi = [
+        ("kontakt mail: f-string", lambda: staro_kontakt(**PODACI)),
+        ("kontakt mail: šablon", lambda: novo_kontakt(**PODACI)),
+        ("potvrdi_termin: kompajliranje po pozivu", lambda: A.app.jinja_env.from_string(izvor).render(korak=A.SLOT_KORAK_MIN, **stranica)),
+        ("potvrdi_termin: keširan šablon", lambda: A.app.jinja_env.get_template("potvrdi_termin.html").render(korak=A.SLOT_KORAK_MIN, **stranica)),
+        ("potvrdi_termin: predrenderovan", lambda: A.potvrdi_stranica().render(**stranica)),
+    ]
+    print(f"{'test':<42} {'µs/poziv':>10}")
+    for ime, fn in testovi:
+        n = args.n if "kompajliranje" not in ime else max(1, args.n // 100)
+        t = min(timeit.repeat(fn, number=n, repeat=3)) / n
+        print(f"{ime:<42} {t * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Lokalna zamjena za SMTP server (za testiranje mail reda i benchmark).
+
+    python tools/fake_smtp.py --port 1025 --delay 0.5
+
+pa app pokrenuti sa SMTP_HOST=127.0.0.1 SMTP_PORT=1025 SMTP_SSL=0.
+--delay simulira sporo slanje (sekunde po poruci), --fail N odbija svaku
+N-tu poruku (451), --dir upisuje primljene poruke kao .eml fajlove.
+"""
+import argparse, os, socketserver, threading, time
+
+STATS = {"poruka": 0, "konekcija": 0}
+_lock = threading.Lock()
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    delay = 0.0
+    fail_every = 0
+    out_dir = None
+
+    def reply(self, line):
+        self.wfile.write((line + "\r\n").encode("ascii"))
+        self.wfile.flush()
+
+    def handle(self):
+        try:
+            self._sesija()
+        except ConnectionError:
+            pass  # klijent prekinuo vezu (npr. app ugašen usred sesije)
+
+    def _sesija(self):
+        with _lock:
+            STATS["konekcija"] += 1
+        self.reply("220 fake-smtp ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            cmd = line.decode("utf-8", "replace").strip()
+            verb = cmd.split(" ", 1)[0].upper()
+            if verb == "EHLO":
+                self.reply("250-fake-smtp")
+                self.reply("250-AUTH PLAIN LOGIN")
+                self.reply("250 8BITMIME")
+            elif verb == "HELO":
+                self.reply("250 fake-smtp")
+            elif verb == "AUTH":
+                self.reply("235 2.7.0 Authentication successful")
+            elif verb in ("MAIL", "RCPT", "RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                while True:
+                    l = self.rfile.readline()
+                    if not l or l in (b".\r\n", b".\n"):
+                        break
+                    data.append(l)
+                if self.delay:
+                    time.sleep(self.delay)
+                with _lock:
+                    STATS["poruka"] += 1
+                    n = STATS["poruka"]
+                if self.fail_every and n % self.fail_every == 0:
+                    self.reply("451 4.3.0 Simulated temporary failure")
+                    continue
+                if self.out_dir:
+                    with open(os.path.join(self.out_dir, f"{n:06d}.eml"), "wb") as f:
+                        f.writelines(data)
+                self.reply("250 OK queued")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(host="127.0.0.1", port=1025, delay=0.0, fail_every=0, out_dir=None):
+    """Pokreće server u pozadinskoj niti i vraća ga (server.shutdown() za kraj)."""
+    handler = type("H", (SMTPHandler,), {"delay": delay, "fail_every": fail_every, "out_dir": out_dir})
+    srv = Server((host, port), handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=1025)
+    ap.add_argument("--delay", type=float, default=0.0)
+    ap.add_argument("--fail", type=int, default=0)
+    ap.add_argument("--dir", default=None)
+    a = ap.parse_args()
+    if a.dir:
+        os.makedirs(a.dir, exist_ok=True)
+    srv = serve(a.host, a.port, a.delay, a.fail, a.dir)
+    print(f"fake SMTP na {a.host}:{a.port} (delay={a.delay}s)", flush=True)
+    try:
+        while True:
+            time.sleep(5)
+            print(f"primljeno poruka: {STATS['poruka']}, konekcija: {STATS['konekcija']}", flush=True)
+    except KeyboardInterrupt:
+        srv.shutdown()
+
+
+if __name__ == "__main__":
+    main()
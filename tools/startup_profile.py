@@ -0,0 +1,108 @@
+"""
+Profil pokretanja: koliko košta `import app` (po modulu, -X importtime) i
+koliko je prvi zahtjev sporiji od sljedećih, sa i bez zagrijavanja.
+
+    python tools/startup_profile.py            # top 25 modula
+    python tools/startup_profile.py --top 50
+
+Svako mjerenje je u novom procesu, sa privremenim CSV/DB/spool putanjama.
+Napomena: bez __pycache__ (Render free plan poslije buđenja) se app.py
+kompajlira iz izvora – zato render.yaml u build koraku radi compileall.
+"""
+import argparse, json, os, subprocess, sys, tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MJERENJE = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import app
+t_import = time.perf_counter() - t0
+c = app.app.test_client()
+rez = {"import_ms": t_import * 1000}
+for ruta in ("/", "/api/status", "/potvrdi_termin"):
+    vremena = []
+    for _ in range(3):
+        t0 = time.perf_counter()
+        r = c.get(ruta)
+        vremena.append((time.perf_counter() - t0) * 1000)
+        assert r.status_code == 200, (ruta, r.status_code)
+    rez[ruta] = vremena
+print("REZ " + json.dumps(rez))
+"""
+
+
+def env_za(tmp, **dodatno):
+    env = dict(os.environ)
+    env.update({
+        "CSV_PATH": os.path.join(tmp, "poruke.csv"),
+        "MAIL_SPOOL_DIR": os.path.join(tmp, "mail_spool"),
+        "PYTHONPATH": ROOT,
+    })
+    env.update(dodatno)
+    return env
+
+
+def importtime(tmp):
+    """[(self_us, cumulative_us, ime)] iz -X importtime."""
+    p = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=ROOT, env=env_za(tmp, WARMUP="0"), capture_output=True, text=True, check=True,
+    )
+    redovi = []
+    for linija in p.stderr.splitlines():
+        if not linija.startswith("import time:") or "self [us]" in linija:
+            continue
+        self_us, kum_us, ime = linija[len("import time:"):].split("|")
+        redovi.append((int(self_us), int(kum_us), ime.rstrip()))
+    return redovi
+
+
+def prvi_zahtjevi(tmp, warmup):
+    p = subprocess.run(
+        [sys.executable, "-c", MJERENJE],
+        cwd=ROOT, env=env_za(tmp, WARMUP=warmup), capture_output=True, text=True, check=True,
+    )
+    for linija in p.stdout.splitlines():
+        if linija.startswith("REZ "):
+            return json.loads(linija[4:])
+    raise RuntimeError(p.stdout + p.stderr)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Dentalab: profil pokretanja.")
+    ap.add_argument("--top", type=int, default=25)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="dentalab-start-")
+    redovi = importtime(tmp)
+    app_red = next(r for r in redovi if r[2].strip() == "app")
+    print(f"import app: ukupno {app_red[1] / 1000:.1f} ms, od toga sam app.py {app_red[0] / 1000:.1f} ms\n")
+
+    print(f"Top {args.top} po kumulativnom vremenu (ms):")
+    print(f"{'kumulativno':>12} {'samo':>8}  modul")
+    for self_us, kum_us, ime in sorted(redovi, key=lambda r: -r[1])[:args.top]:
+        print(f"{kum_us / 1000:>12.1f} {self_us / 1000:>8.1f}  {ime}")
+
+    # paketi najvišeg nivoa (flask, werkzeug, jinja2, email...) – gdje ide vrijeme
+    po_paketu = {}
+    for self_us, _, ime in redovi:
+        paket = ime.strip().split(".")[0]
+        po_paketu[paket] = po_paketu.get(paket, 0) + self_us
+    print("\nPo paketu (zbir self, ms):")
+    for paket, us in sorted(po_paketu.items(), key=lambda kv: -kv[1])[:15]:
+        print(f"{us / 1000:>8.1f}  {paket}")
+
+    mail = [ime.strip() for _, _, ime in redovi if ime.strip() in ("smtplib", "email.policy", "email.headerregistry")]
+    print(f"\nMail paket učitan pri importu: {', '.join(mail) if mail else 'ne (lijeno učitavanje)'}")
+
+    for warmup in ("0", "1"):
+        rez = prvi_zahtjevi(tempfile.mkdtemp(prefix="dentalab-start-"), warmup)
+        print(f"\nWARMUP={warmup}: import {rez['import_ms']:.1f} ms")
+        for ruta in ("/", "/api/status", "/potvrdi_termin"):
+            v = rez[ruta]
+            print(f"  {ruta:<16} prvi {v[0]:>7.2f} ms   zatim {v[1]:>6.2f} / {v[2]:>6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()